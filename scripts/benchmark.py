@@ -0,0 +1,129 @@
+import numpy as np
+import tools, readsnap, readgadget, readfof, synthetic
+import json, os, sys, time, tracemalloc
+
+import argparse
+
+
+#########################################################################################
+# Benchmarks of the readers, painting, power spectra, filters and the linear power
+# on synthetic snapshots and catalogs (see synthetic.py), written once per size to
+# folder/N<npart>_G<ngroups>/.
+# Every case reports the best time of nrep runs, the throughput and the peak memory
+# allocated during one extra run (tracemalloc, numpy buffers included).
+# Results can be saved as a JSON baseline, and a later run compared against it,
+# flagging cases slower or more memory hungry than the baseline by more than tolerance.
+#
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --baseline baseline.json      #exit status 1 on regressions
+
+
+def timeit(func, nrep=3):
+    tt = []
+    for i in range(nrep):
+        t0 = time.time()
+        func()
+        tt.append(time.time() - t0)
+    return min(tt)
+
+
+def peakmemory(func):
+    """ Peak memory in MB allocated while running func """
+    tracemalloc.start()
+    try: func()
+    finally:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak/2**20
+
+
+def makedata(folder, npart, ngroups, nfiles):
+    folder = folder + 'N%d_G%d/'%(npart, ngroups)
+    if not os.path.exists(folder + 'done'):
+        os.makedirs(folder, exist_ok=True)
+        synthetic.write_gadget(folder + 'snap_format1', npart, nfiles=nfiles, format=1)
+        synthetic.write_gadget(folder + 'snap_format2', npart, nfiles=nfiles, format=2)
+        synthetic.write_hdf5(folder + 'snap_hdf5', npart, nfiles=nfiles)
+        synthetic.write_fof(folder, 4, ngroups, nfiles=nfiles)
+        open(folder + 'done', 'w').close()
+    return folder
+
+
+def cases(folder, npart, ngroups, nc, bs=1000.):
+    """ List of (name, function, number of items processed, unit) """
+    pos = readgadget.read_block(folder + 'snap_hdf5', "POS ", [1])/1e3
+    mesh = tools.paintcic(pos, bs, nc)
+    kvec = tools.fftk((nc,)*3, bs)
+    kny = np.pi*nc/bs
+    ncells = nc**3
+    cases = [
+        ('readsnap.read_block format1', lambda: readsnap.read_block(folder + 'snap_format1', "POS ", 1), npart, 'particles'),
+        ('readsnap.read_block format2', lambda: readsnap.read_block(folder + 'snap_format2', "POS ", 1), npart, 'particles'),
+        ('readgadget.read_block format2', lambda: readgadget.read_block(folder + 'snap_format2', "POS ", [1]), npart, 'particles'),
+        ('readgadget.read_block hdf5', lambda: readgadget.read_block(folder + 'snap_hdf5', "POS ", [1]), npart, 'particles'),
+        ('readfof.FoF_catalog', lambda: readfof.FoF_catalog(folder, 4, read_IDs=False), ngroups, 'halos'),
+        ('tools.paint', lambda: tools.paintcic(pos, bs, nc), npart, 'particles'),
+        ('tools.power', lambda: tools.power(mesh, boxsize=bs), ncells, 'cells'),
+        ('tools.gauss', lambda: tools.gauss(mesh, kvec, 10.), ncells, 'cells'),
+        ('tools.fingauss', lambda: tools.fingauss(mesh, kvec, 10., kny), ncells, 'cells'),
+        ('tools.tophat', lambda: tools.tophat(mesh, kvec, 10.), ncells, 'cells'),
+    ]
+    try:
+        import pslin
+        import tensorflow as tf
+        params = tf.constant(np.array([0.25, 0.8, 0.05, 0.7], dtype=np.float32))
+        pslin.ps(params)        #trace the tf.function once
+        cases.append(('pslin.ps', lambda: pslin.ps(params), 1, 'calls'))
+    except ImportError as e:
+        print("skipping pslin.ps : %s"%e)
+    return cases
+
+
+def run(folder, npart=128**3, ngroups=10**5, nc=128, nfiles=8, nrep=3, names=None):
+    folder = makedata(folder, npart, ngroups, nfiles)
+    results = {}
+    for name, func, nitems, unit in cases(folder, npart, ngroups, nc):
+        if names is not None and not any(n in name for n in names): continue
+        tt = timeit(func, nrep)
+        results[name] = {'time':tt, 'throughput':nitems/tt, 'unit':unit+'/s', 'peakmem':peakmemory(func)}
+        print("%32s : %8.4f s, %10.3e %s/s, peak memory %8.1f MB"%(name, tt, nitems/tt, unit, results[name]['peakmem']))
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """ Names of the cases slower or using more memory than baseline by more than tolerance """
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline: continue
+        base = baseline[name]
+        slower = res['time']/base['time']
+        memory = res['peakmem']/max(base['peakmem'], 1e-3)
+        flag = slower > 1 + tolerance or memory > 1 + tolerance
+        if flag: regressions.append(name)
+        print("%32s : time x%0.2f, memory x%0.2f %s"%(name, slower, memory, 'REGRESSION' if flag else ''))
+    return regressions
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark readers, painting and power spectra on synthetic data.')
+    parser.add_argument('--folder', type=str, default='./benchdata/', help='where to write the synthetic files')
+    parser.add_argument('--npart', type=int, default=128**3, help='number of particles')
+    parser.add_argument('--ngroups', type=int, default=10**5, help='number of halos')
+    parser.add_argument('--nc', type=int, default=128, help='Nmesh')
+    parser.add_argument('--nfiles', type=int, default=8, help='files per snapshot and catalog')
+    parser.add_argument('--nrep', type=int, default=3, help='repetitions, the best time is kept')
+    parser.add_argument('--cases', type=str, nargs='+', default=None, help='only run cases containing these names')
+    parser.add_argument('--save', type=str, default=None, help='save the results as a JSON baseline')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='relative slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    results = run(args.folder, npart=args.npart, ngroups=args.ngroups, nc=args.nc,
+                  nfiles=args.nfiles, nrep=args.nrep, names=args.cases)
+    if args.save is not None:
+        with open(args.save, 'w') as f: json.dump(results, f, indent=1)
+    if args.baseline is not None:
+        with open(args.baseline) as f: baseline = json.load(f)
+        if len(compare(results, baseline, tolerance=args.tolerance)): sys.exit(1)
@@ -0,0 +1,124 @@
+import numpy as np
+import json, os, pickle, time
+from multiprocessing import Pool
+
+import argparse
+
+
+#########################################################################################
+# Simulation-based calibration and coverage of a trained posterior over all test sims.
+# Posterior samples are drawn for every test observation (in batches, over several
+# processes, each loading the pickled sbi posterior once), then per parameter
+#   ranks     : number of samples below the true value, uniform for a calibrated posterior
+#   coverage  : fraction of true values inside the central credible interval of each level
+# are reduced to a short report (json) that can be compared between feature sets,
+#
+#   python calibration.py --posterior posterior_pk.pkl --x x_test.npy --theta params_test.npy --name pk
+#   python calibration.py --compare report_pk.json report_wavelets.json
+
+
+def ranks(samples, truth):
+    """ samples (nsim, nsamples, nparams), truth (nsim, nparams) -> ranks (nsim, nparams) """
+    return (samples < truth[:, None, :]).sum(axis=1)
+
+
+def coverage(samples, truth, levels=(0.5, 0.68, 0.9, 0.95)):
+    """ Empirical coverage (nlevels, nparams) of the central credible intervals """
+    out = []
+    for level in levels:
+        lo, hi = np.quantile(samples, [(1 - level)/2, (1 + level)/2], axis=1)
+        out.append(((truth >= lo) & (truth <= hi)).mean(axis=0))
+    return np.array(out)
+
+
+def uniformity(rank, nsamples, nbins=20):
+    """ chi^2 per degree of freedom of the rank histogram against a uniform one """
+    counts = np.stack([np.histogram(r, bins=nbins, range=(0, nsamples + 1))[0] for r in rank.T])
+    expected = rank.shape[0]/nbins
+    return ((counts - expected)**2/expected).sum(axis=1)/(nbins - 1)
+
+
+_posterior = None
+
+def _load(fname):
+    global _posterior
+    import torch
+    torch.set_num_threads(1)
+    with open(fname, 'rb') as f: _posterior = pickle.load(f)
+
+
+def _sample(args):
+    """ Samples (len(xs), nsamples, nparams) for a block of observations """
+    xs, nsamples = args
+    import torch
+    xs = torch.from_numpy(np.asarray(xs, dtype=np.float32))
+    if hasattr(_posterior, 'sample_batched'):
+        s = _posterior.sample_batched((nsamples,), x=xs, show_progress_bars=False)
+        return s.numpy().transpose(1, 0, 2)
+    return np.stack([_posterior.sample((nsamples,), x=x, show_progress_bars=False).numpy() for x in xs])
+
+
+def sample(posterior, xs, nsamples=1000, nworkers=4, batch=16):
+    """ Posterior samples for every row of xs, posterior is the file of a pickled sbi posterior """
+    blocks = [(xs[i:i+batch], nsamples) for i in range(0, len(xs), batch)]
+    with Pool(nworkers, initializer=_load, initargs=(posterior,)) as pool:
+        return np.concatenate(pool.map(_sample, blocks))
+
+
+def report(samples, truth, names=None, levels=(0.5, 0.68, 0.9, 0.95)):
+    """ Compact calibration summary of the samples of every test simulation """
+    rank = ranks(samples, truth)
+    names = names or ['p%d'%i for i in range(truth.shape[1])]
+    cov = coverage(samples, truth, levels)
+    chi2 = uniformity(rank, samples.shape[1])
+    std = samples.std(axis=1)
+    bias = samples.mean(axis=1) - truth
+    out = {'nsim':int(truth.shape[0]), 'nsamples':int(samples.shape[1]), 'levels':list(levels), 'params':{}}
+    for i, name in enumerate(names):
+        out['params'][name] = {'coverage':cov[:, i].tolist(), 'rank_chi2':float(chi2[i]),
+                               'std':float(std[:, i].mean()), 'bias':float(bias[:, i].mean()),
+                               'rmse':float(np.sqrt((bias[:, i]**2).mean()))}
+    return out
+
+
+def printreport(reports):
+    """ Side by side table of a dict {name: report} """
+    first = list(reports.values())[0]
+    levels = first['levels']
+    header = "%10s %10s "%('params', 'features') + " ".join("cov%4.2f"%l for l in levels) + "  rank chi2    std   rmse"
+    print(header)
+    for param in first['params']:
+        for name, rep in reports.items():
+            r = rep['params'][param]
+            print("%10s %10s "%(param, name) + " ".join("%7.3f"%c for c in r['coverage'])
+                  + "  %9.2f %6.3f %6.3f"%(r['rank_chi2'], r['std'], r['rmse']))
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Rank statistics and coverage of a trained posterior on the test sims.')
+    parser.add_argument('--posterior', type=str, default=None, help='pickled sbi posterior')
+    parser.add_argument('--x', type=str, default=None, help='.npy of test features')
+    parser.add_argument('--theta', type=str, default=None, help='.npy of test parameters')
+    parser.add_argument('--name', type=str, default='features', help='name of the feature set, saves report_<name>.json')
+    parser.add_argument('--params', type=str, nargs='+', default=['Om', 'Ob', 'h', 'ns', 's8'], help='parameter names')
+    parser.add_argument('--nsamples', type=int, default=1000, help='posterior samples per test sim')
+    parser.add_argument('--nworkers', type=int, default=4, help='number of processes')
+    parser.add_argument('--batch', type=int, default=16, help='test sims per task')
+    parser.add_argument('--compare', type=str, nargs='+', default=None, help='print saved reports side by side')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        reports = {}
+        for fname in args.compare:
+            with open(fname) as f: reports[os.path.splitext(os.path.basename(fname))[0]] = json.load(f)
+        printreport(reports)
+    else:
+        xs, truth = np.load(args.x), np.load(args.theta)
+        t0 = time.time()
+        samples = sample(args.posterior, xs, nsamples=args.nsamples, nworkers=args.nworkers, batch=args.batch)
+        print("%d sims x %d samples in %0.1f s"%(len(xs), args.nsamples, time.time() - t0))
+        rep = report(samples, truth, names=args.params)
+        with open('report_%s.json'%args.name, 'w') as f: json.dump(rep, f, indent=1)
+        printreport({args.name:rep})
@@ -0,0 +1,108 @@
+import numpy as np
+import streamstats
+
+import argparse
+
+
+#########################################################################################
+# Linear compression of feature vectors to one summary per parameter before SBI training.
+# The mean feature mu and its derivatives dmu/dtheta at a fiducial point are estimated
+# from the latin hypercube with a (locally weighted) linear regression on the parameters,
+# and the covariance C from the fiducial realizations (streamstats.RunningStats).
+#   method='score' : t = theta0 + F^-1 dmu^T C^-1 (x - mu), F = dmu^T C^-1 dmu
+#                    (quasi maximum likelihood estimate, in units of the parameters)
+#   method='moped' : t = B (x - mu) with the Gram-Schmidt orthonormalized MOPED vectors
+# Both keep the Fisher information of a Gaussian likelihood around theta0.
+#
+#   comp = fit(x_lh, params_lh, x_fid, method='score')
+#   comp.save('../data/compression_score')
+#   t_train = comp(x_train)                   #(nsim, nparams)
+
+
+class LinearCompression:
+    def __init__(self, matrix, mean, offset):
+        """ t = (x - mean) @ matrix.T + offset """
+        self.matrix = np.asarray(matrix)
+        self.mean = np.asarray(mean)
+        self.offset = np.asarray(offset)
+
+    def __call__(self, x):
+        x = np.asarray(x)
+        return (x.reshape(-1, self.mean.size) - self.mean) @ self.matrix.T + self.offset
+
+    def save(self, fname):
+        np.savez(fname, matrix=self.matrix, mean=self.mean, offset=self.offset)
+
+    @classmethod
+    def load(cls, fname):
+        f = np.load(fname)
+        return cls(f['matrix'], f['mean'], f['offset'])
+
+
+def derivatives(x, params, theta0=None, nneighbours=None):
+    """ Mean features and their derivatives (nparams, nfeatures) at theta0 from a
+    linear fit of x on params. If nneighbours is given, only the nearest simulations
+    to theta0 (in units of the parameter standard deviations) enter the fit.
+    """
+    x, params = np.asarray(x, dtype=np.float64), np.asarray(params, dtype=np.float64)
+    if theta0 is None: theta0 = params.mean(axis=0)
+    dtheta = params - theta0
+    if nneighbours is not None:
+        dist = ((dtheta/params.std(axis=0))**2).sum(axis=1)
+        near = np.argsort(dist)[:nneighbours]
+        x, dtheta = x[near], dtheta[near]
+    design = np.concatenate([np.ones((dtheta.shape[0], 1)), dtheta], axis=1)
+    coeffs = np.linalg.lstsq(design, x, rcond=None)[0]
+    return coeffs[0], coeffs[1:]
+
+
+def score_matrix(dmu, prec):
+    """ F^-1 dmu^T C^-1 """
+    fisher = dmu @ prec @ dmu.T
+    return np.linalg.solve(fisher, dmu @ prec)
+
+
+def moped_matrix(dmu, prec):
+    """ MOPED vectors, rows b_i with b_i C b_j = delta_ij """
+    B = []
+    for i in range(dmu.shape[0]):
+        b = prec @ dmu[i]
+        norm = dmu[i] @ prec @ dmu[i]
+        for bq in B:
+            proj = dmu[i] @ bq
+            b = b - proj*bq
+            norm -= proj**2
+        B.append(b/np.sqrt(norm))
+    return np.array(B)
+
+
+def fit(x, params, fiducial, theta0=None, method='score', nneighbours=None):
+    """ Compression fitted on the latin hypercube features x and params, with the
+    covariance of the fiducial features (an array or a streamstats.RunningStats).
+    """
+    if theta0 is None: theta0 = np.asarray(params).mean(axis=0)
+    mu, dmu = derivatives(x, params, theta0, nneighbours=nneighbours)
+    if not isinstance(fiducial, streamstats.RunningStats):
+        fiducial = streamstats.RunningStats().update(fiducial)
+    prec = fiducial.precision()
+    if method == 'score': return LinearCompression(score_matrix(dmu, prec), mu, theta0)
+    elif method == 'moped': return LinearCompression(moped_matrix(dmu, prec), mu, np.zeros(dmu.shape[0]))
+    else: raise Exception('Unknown compression %s'%method)
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Fit a linear compression of features to one summary per parameter.')
+    parser.add_argument('--features', type=str, help='.npy of latin hypercube features (nsim, nfeatures)')
+    parser.add_argument('--params', type=str, help='.npy of latin hypercube parameters (nsim, nparams)')
+    parser.add_argument('--fiducial', type=str, help='.npy of fiducial features, or a streamstats checkpoint .npz')
+    parser.add_argument('--method', type=str, default='score', help='score or moped')
+    parser.add_argument('--nneighbours', type=int, default=None, help='simulations nearest to the fiducial used for the derivatives')
+    parser.add_argument('--savepath', type=str, default='./compression', help='saves the compression matrices in savepath.npz')
+    args = parser.parse_args()
+
+    if args.fiducial.endswith('.npz'): fiducial = streamstats.RunningStats.load(args.fiducial)
+    else: fiducial = np.load(args.fiducial)
+    comp = fit(np.load(args.features), np.load(args.params), fiducial, method=args.method, nneighbours=args.nneighbours)
+    comp.save(args.savepath)
@@ -0,0 +1,86 @@
+import numpy as np
+import fftbackend, crosspower
+
+import argparse
+
+
+#########################################################################################
+# Two-point correlation function xi(r) and its multipoles on the mesh.
+# With the demeaned modes of crosspower (c = rfft(delta)/N), the periodic correlation
+# of two fields at every separation vector of the mesh is
+#   xi(r) = N irfft(c1 conj(c2))
+# which is averaged in bins of |r| with a crosspower.Binner built once per mesh.
+# Multipoles along the line of sight axis weight every separation by (2l+1) L_l(mu).
+# The default bins have the width of a cell, centered on multiples of the cell size
+# up to half the box, so the zero lag (shot noise) is left out.
+
+
+class Correlation:
+    def __init__(self, nc, boxsize, edges=None, ells=(0,), los=2):
+        self.nc, self.boxsize, self.ells = nc, boxsize, list(ells)
+        cell = boxsize/nc
+        if edges is None: edges = (np.arange(nc//2 + 1) + 0.5)*cell
+        rvec = [np.fft.fftfreq(nc)*boxsize]*3
+        rvec = [r.reshape([-1 if i == j else 1 for j in range(3)]) for i, r in enumerate(rvec)]
+        rr = sum(r**2 for r in rvec)**0.5
+        self.binner = crosspower.Binner(np.broadcast_to(rr, (nc,)*3), edges)
+        self.r = self.binner.centers
+        self.weights = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mu = np.where(rr > 0, rvec[los]/rr, 0)
+        for l in self.ells:
+            if l == 0: continue
+            legendre = np.polynomial.legendre.legval(mu, [0]*l + [1])
+            self.weights[l] = ((2*l + 1)*legendre).astype(np.float32)
+
+
+    def __call__(self, c1, c2=None):
+        """ Multipoles {l: xi_l(r)} from demeaned modes (crosspower.modes/loadmodes) """
+        if c2 is None: prod = c1.real**2 + c1.imag**2
+        else: prod = c1*np.conj(c2)
+        xi = fftbackend.irfftn(prod, s=(self.nc,)*3)
+        xi *= self.nc**3
+        return dict((l, self.binner(xi, self.weights.get(l))) for l in self.ells)
+
+
+    def correlations(self, cs):
+        """ All auto and cross multipoles of a dict {name: modes}, as crosspower.spectra_modes """
+        names = list(cs.keys())
+        out = {}
+        for i, n1 in enumerate(names):
+            for n2 in names[i:]:
+                out[(n1, n2)] = self(cs[n1], None if n1 == n2 else cs[n2])
+        return out
+
+
+def sim_correlations(engine, matterpath, halopath, halonames, save=True):
+    """ Correlations of the matter field and halo fields of one simulation, saved in
+    halopath/correlation.npz with arrays r and xi<l>_<n1>_<n2>.
+    """
+    cs = {'matter':crosspower.loadmodes(matterpath + 'field')}
+    for name in halonames: cs[name] = crosspower.loadmodes(halopath + name)
+    out = {'r':engine.r}
+    for (n1, n2), xis in engine.correlations(cs).items():
+        for l, xi in xis.items(): out['xi%d_%s_%s'%(l, n1, n2)] = xi
+    if save: np.savez(halopath + 'correlation', **out)
+    return out
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Matter and halo auto and cross correlation functions.')
+    parser.add_argument('--matterfolder', type=str, help='matter fields in matterfolder/%%04d/')
+    parser.add_argument('--halofolder', type=str, help='halo fields in halofolder/%%04d/, correlations are saved there')
+    parser.add_argument('--halonames', type=str, nargs='+', default=['field', 'field_n1e-03', 'field_n5e-04', 'field_n1e-04'], help='halo fields')
+    parser.add_argument('--ells', type=int, nargs='+', default=[0], help='multipoles')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=2000, help='last sim')
+    parser.add_argument('--nc', type=int, default=256, help='Nmesh')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    args = parser.parse_args()
+
+    engine = Correlation(args.nc, args.bs, ells=args.ells)
+    for idd in range(args.id0, args.id1):
+        print(idd)
+        sim_correlations(engine, args.matterfolder + '%04d/'%idd, args.halofolder + '%04d/'%idd, args.halonames)
@@ -0,0 +1,156 @@
+import numpy as np
+import tools, fftbackend, fieldio
+import time
+
+import argparse
+
+
+#########################################################################################
+# All auto and cross power spectra of a set of fields, e.g. the matter field and the
+# halo fields of one simulation, with a single forward FFT per field.
+# The |k| bin of every mode is computed once (powerbinner) and the spectra are bincounts,
+# binned exactly as tools.power. Derived halo statistics against the matter field:
+#   bias          b = P_hm/P_mm
+#   correlation   r = P_hm/sqrt(P_hh P_mm)
+#   stochasticity P_hh - P_hm^2/P_mm  (= P_hh (1 - r^2), includes shot noise)
+
+
+class Binner:
+    def __init__(self, values, edges, norm=1.):
+        """ Bin index of every element of values (e.g. |k| or |r| on the mesh), the last
+        edge is inclusive and elements outside the edges are dropped.
+        """
+        values = np.asarray(values).ravel()
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.nbins = self.edges.size - 1
+        self.norm = norm
+        index = np.searchsorted(self.edges, values, side='right') - 1
+        index[values == self.edges[-1]] = self.nbins - 1
+        index[(index < 0) | (index >= self.nbins)] = self.nbins
+        self.index = index.astype(np.int32)
+        self.counts = np.bincount(self.index, minlength=self.nbins+1)[:self.nbins].astype(np.float64)
+        self.centers = 0.5*(self.edges[1:] + self.edges[:-1])
+
+    def __call__(self, x, weights=None):
+        """ Average x in the bins, times norm, with optional weights per element """
+        x = x.ravel() if weights is None else x.ravel()*weights.ravel()
+        H = np.bincount(self.index, weights=x, minlength=self.nbins+1)[:self.nbins]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = H*self.norm/self.counts
+        out[out == 0] = np.nan
+        return out
+
+
+def powerbinner(shape, boxsize):
+    """ |k| bins of the rfft modes, shape[0] bins between min and max as in tools.binpower """
+    kvec = tools.fftk(shape, boxsize, dtype=np.float64)
+    kk = sum(k**2 for k in kvec)**0.5
+    return Binner(kk, np.linspace(kk.min(), kk.max(), shape[0]+1), norm=boxsize**3)
+
+
+def modes(field):
+    """ rfft of field/mean, with the zero mode removed """
+    c = fftbackend.rfftn(np.asarray(field))
+    return demean(c)
+
+
+def demean(c):
+    """ Modes of field/mean in place, the zero mode removed """
+    c /= c[0, 0, 0].real
+    c[0, 0, 0] = 0
+    return c
+
+
+def loadmodes(fname):
+    """ Modes of a saved field, from its cached rfft when it exists """
+    if fieldio.modes_exist(fname): return demean(np.array(fieldio.load_modes(fname)))
+    return modes(fieldio.load_field(fname))
+
+
+def spectra(fields, boxsize, binner=None):
+    """ fields is a dict {name: real field}. Returns k and a dict {(name1, name2): power}
+    with every auto and cross spectrum, name1 <= name2 in the order of fields.
+    """
+    names = list(fields.keys())
+    if binner is None: binner = powerbinner(fields[names[0]].shape, boxsize)
+    cs = dict((name, modes(fields[name])) for name in names)
+    return spectra_modes(cs, binner)
+
+
+def spectra_modes(cs, binner):
+    """ As spectra, for a dict {name: modes} of demeaned modes """
+    names = list(cs.keys())
+    ps = {}
+    for i, n1 in enumerate(names):
+        for n2 in names[i:]:
+            x = cs[n1].real*cs[n2].real + cs[n1].imag*cs[n2].imag
+            ps[(n1, n2)] = binner(x)
+    return binner.centers, ps
+
+
+def halostats(ps, matter, halo):
+    """ Bias, correlation coefficient and stochasticity of halo with respect to matter """
+    pmm, phh = ps[(matter, matter)], ps[(halo, halo)]
+    phm = ps[(matter, halo)] if (matter, halo) in ps else ps[(halo, matter)]
+    return {'bias':phm/pmm, 'r':phm/(phh*pmm)**0.5, 'stochasticity':phh - phm**2/pmm}
+
+
+def sim_spectra(matterpath, halopath, halonames, boxsize=1000., binner=None, save=True):
+    """ Spectra of the matter field of matterpath and the halo fields halonames of halopath.
+    Saved in halopath/spectra.npz with arrays k, P_<n1>_<n2> and <stat>_<halo>.
+    """
+    cs = {'matter':loadmodes(matterpath + 'field')}
+    for name in halonames: cs[name] = loadmodes(halopath + name)
+    if binner is None:
+        nc = cs['matter'].shape[0]
+        binner = powerbinner((nc, nc, nc), boxsize)
+    k, ps = spectra_modes(cs, binner)
+    out = {'k':k}
+    for (n1, n2), p in ps.items(): out['P_%s_%s'%(n1, n2)] = p
+    for name in halonames:
+        for stat, val in halostats(ps, 'matter', name).items(): out['%s_%s'%(stat, name)] = val
+    if save: np.savez(halopath + 'spectra', **out)
+    return out
+
+
+def benchmark(nc=256, bs=1000., nfields=4, seed=0):
+    """ Shared transforms against one tools.power call per spectrum """
+    rng = np.random.RandomState(seed)
+    fields = dict(('f%d'%i, rng.uniform(0.5, 1.5, size=(nc,)*3).astype(np.float32)) for i in range(nfields))
+    names = list(fields.keys())
+    t0 = time.time()
+    binner = powerbinner((nc,)*3, bs)
+    t1 = time.time()
+    k, ps = spectra(fields, bs, binner=binner)
+    t2 = time.time()
+    ref = {}
+    for i, n1 in enumerate(names):
+        for n2 in names[i:]:
+            ref[(n1, n2)] = tools.power(fields[n1], None if n1 == n2 else fields[n2], boxsize=bs)[1]
+    t3 = time.time()
+    diff = max(np.nanmax(abs(ps[key] - ref[key]))/np.nanmax(abs(ref[key])) for key in ps)
+    print("nc=%d, %d fields, %d spectra : shared %0.2f s (+%0.2f s bins, reused across sims), per spectrum %0.2f s, speedup %0.1f, max rel diff %0.1e"
+          %(nc, nfields, len(ps), t2-t1, t1-t0, t3-t2, (t3-t2)/(t2-t1), diff))
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Matter and halo auto and cross spectra, bias and stochasticity.')
+    parser.add_argument('--matterfolder', type=str, default=None, help='matter fields in matterfolder/%%04d/')
+    parser.add_argument('--halofolder', type=str, default=None, help='halo fields in halofolder/%%04d/, spectra are saved there')
+    parser.add_argument('--halonames', type=str, nargs='+', default=['field', 'field_n1e-03', 'field_n5e-04', 'field_n1e-04'], help='halo fields')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=2000, help='last sim')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    parser.add_argument('--bench', action='store_true', help='benchmark against per-spectrum tools.power')
+    parser.add_argument('--nc', type=int, default=256, help='Nmesh')
+    args = parser.parse_args()
+
+    if args.bench: benchmark(args.nc, args.bs)
+    else:
+        binner = powerbinner((args.nc,)*3, args.bs)
+        for idd in range(args.id0, args.id1):
+            print(idd)
+            sim_spectra(args.matterfolder + '%04d/'%idd, args.halofolder + '%04d/'%idd,
+                        args.halonames, boxsize=args.bs, binner=binner)
@@ -0,0 +1,189 @@
+import numpy as np
+import os, pickle, time
+
+import argparse
+
+
+#########################################################################################
+# Pluggable FFT backend used by tools.py and the other field operations.
+# The backend is selected once, either with set_backend or with the environment
+# variables FFT_BACKEND (numpy, scipy, fftw) and FFT_THREADS, and all transforms
+# go through the module level rfftn, irfftn, fftn and ifftn.
+# Normalization follows numpy (inverse transforms divide by N).
+# float32 input gives complex64 output for all backends, and out= fills a
+# preallocated array instead of returning a newly allocated one. Only the fftw
+# backend transforms into reused plan buffers; numpy and scipy still allocate the
+# result and copy it into out, so there out= saves no memory or time.
+
+
+def _copyout(result, out):
+    if out is None: return result
+    out[...] = result
+    return out
+
+
+def _single(x):
+    return np.asarray(x).dtype in (np.float32, np.complex64)
+
+
+class NumpyFFT:
+    """ np.fft, single threaded, out= is filled by a copy """
+    name = 'numpy'
+    def __init__(self, threads=None):
+        self.threads = 1
+
+    def rfftn(self, x, axes=None, out=None):
+        c = np.fft.rfftn(x, axes=axes)
+        if _single(x): c = c.astype(np.complex64, copy=False)
+        return _copyout(c, out)
+
+    def irfftn(self, c, s=None, axes=None, out=None):
+        x = np.fft.irfftn(c, s=s, axes=axes)
+        if _single(c): x = x.astype(np.float32, copy=False)
+        return _copyout(x, out)
+
+    def fftn(self, x, axes=None, out=None):
+        c = np.fft.fftn(x, axes=axes)
+        if _single(x): c = c.astype(np.complex64, copy=False)
+        return _copyout(c, out)
+
+    def ifftn(self, c, s=None, axes=None, out=None):
+        x = np.fft.ifftn(c, s=s, axes=axes)
+        if _single(c): x = x.astype(np.complex64, copy=False)
+        return _copyout(x, out)
+
+
+
+class ScipyFFT:
+    """ scipy.fft with workers=threads, out= is filled by a copy (the input is never
+    overwritten, callers reuse it)
+    """
+    name = 'scipy'
+    def __init__(self, threads=None):
+        import scipy.fft
+        self.sfft = scipy.fft
+        self.threads = threads or os.cpu_count()
+
+    def rfftn(self, x, axes=None, out=None):
+        return _copyout(self.sfft.rfftn(x, axes=axes, workers=self.threads), out)
+
+    def irfftn(self, c, s=None, axes=None, out=None):
+        return _copyout(self.sfft.irfftn(c, s=s, axes=axes, workers=self.threads), out)
+
+    def fftn(self, x, axes=None, out=None):
+        return _copyout(self.sfft.fftn(x, axes=axes, workers=self.threads), out)
+
+    def ifftn(self, c, s=None, axes=None, out=None):
+        return _copyout(self.sfft.ifftn(c, s=s, axes=axes, workers=self.threads), out)
+
+
+
+class FFTWFFT:
+    name = 'fftw'
+    def __init__(self, threads=None, wisdom=None, effort='FFTW_MEASURE'):
+        """ pyFFTW plans are cached per (transform, shape, dtype, axes) and reused.
+        If wisdom is a file name, it is imported here and updated by save_wisdom.
+        """
+        import pyfftw, pyfftw.builders
+        self.pyfftw = pyfftw
+        self.threads = threads or os.cpu_count()
+        self.effort = effort
+        self.wisdom = wisdom
+        self.plans = {}
+        if wisdom is not None and os.path.exists(wisdom):
+            with open(wisdom, 'rb') as f: pyfftw.import_wisdom(pickle.load(f))
+
+    def save_wisdom(self, fname=None):
+        fname = fname or self.wisdom
+        with open(fname, 'wb') as f: pickle.dump(self.pyfftw.export_wisdom(), f)
+
+    def _plan(self, kind, x, s, axes):
+        key = (kind, x.shape, x.dtype.str, s, axes)
+        if key not in self.plans:
+            builder = getattr(self.pyfftw.builders, kind)
+            kwargs = dict(axes=axes, threads=self.threads, planner_effort=self.effort)
+            if s is not None: kwargs['s'] = s
+            self.plans[key] = builder(self.pyfftw.empty_aligned(x.shape, dtype=x.dtype), **kwargs)
+        return self.plans[key]
+
+    def _run(self, kind, x, s=None, axes=None, out=None):
+        x = np.asarray(x)
+        s = None if s is None else tuple(s)
+        #numpy defaults: all axes, or the last len(s) axes if s is given
+        if axes is None: axes = tuple(range(x.ndim)) if s is None else tuple(range(-len(s), 0))
+        else: axes = tuple(axes)
+        plan = self._plan(kind, x, s, axes)
+        plan.input_array[...] = x
+        plan.execute()
+        result = plan.output_array
+        if plan.normalise_idft and kind in ['irfftn', 'ifftn']:
+            result *= 1./plan.N
+        if out is None: return result.copy()
+        out[...] = result
+        return out
+
+    def rfftn(self, x, axes=None, out=None): return self._run('rfftn', x, axes=axes, out=out)
+    def irfftn(self, c, s=None, axes=None, out=None): return self._run('irfftn', c, s=s, axes=axes, out=out)
+    def fftn(self, x, axes=None, out=None): return self._run('fftn', x, axes=axes, out=out)
+    def ifftn(self, c, s=None, axes=None, out=None): return self._run('ifftn', c, s=s, axes=axes, out=out)
+
+
+
+backends = {'numpy':NumpyFFT, 'scipy':ScipyFFT, 'fftw':FFTWFFT}
+backend = None
+
+
+def set_backend(name='numpy', threads=None, **kwargs):
+    """ Select the backend used by all transforms, returns it """
+    global backend
+    if name not in backends: raise Exception('Unknown FFT backend %s'%name)
+    backend = backends[name](threads=threads, **kwargs)
+    return backend
+
+
+def rfftn(x, axes=None, out=None): return backend.rfftn(x, axes=axes, out=out)
+def irfftn(c, s=None, axes=None, out=None): return backend.irfftn(c, s=s, axes=axes, out=out)
+def fftn(x, axes=None, out=None): return backend.fftn(x, axes=axes, out=out)
+def ifftn(c, s=None, axes=None, out=None): return backend.ifftn(c, s=s, axes=axes, out=out)
+
+
+_threads = os.environ.get('FFT_THREADS', None)
+set_backend(os.environ.get('FFT_BACKEND', 'numpy'), threads=int(_threads) if _threads else None)
+del _threads
+
+
+
+def benchmark(ncs, names, nrep=3, threads=None):
+    """ Time a forward and inverse real transform for every backend and precision,
+    speedups are relative to numpy in float64.
+    """
+    for nc in ncs:
+        tref = None
+        for dtype in [np.float64, np.float32]:
+            x = np.random.normal(size=(nc, nc, nc)).astype(dtype)
+            for name in names:
+                try: b = backends[name](threads=threads)
+                except ImportError:
+                    print("%s not available"%name)
+                    continue
+                c = b.rfftn(x)
+                xr = np.empty_like(x)
+                b.irfftn(c, s=x.shape, out=xr)
+                t0 = time.time()
+                for i in range(nrep):
+                    b.rfftn(x, out=c)
+                    b.irfftn(c, s=x.shape, out=xr)
+                tt = (time.time() - t0)/nrep
+                if tref is None: tref = tt
+                print("nc=%d %8s %s threads=%d : %0.3f s, speedup %0.2f"%(nc, name, np.dtype(dtype).name, b.threads, tt, tref/tt))
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark FFT backends.')
+    parser.add_argument('--nc', type=int, nargs='+', default=[256, 512], help='mesh sizes')
+    parser.add_argument('--backends', type=str, nargs='+', default=['numpy', 'scipy', 'fftw'], help='backends to time')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads, all cores by default')
+    args = parser.parse_args()
+    benchmark(args.nc, args.backends, threads=args.threads)
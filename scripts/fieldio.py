@@ -0,0 +1,173 @@
+import numpy as np
+import os, time
+import h5py
+
+import argparse
+
+
+#########################################################################################
+# Compact storage of painted fields.
+#   format='npy' : plain .npy in float32 or float16, sub-boxes are read by memory mapping
+#   format='h5'  : chunked HDF5 dataset with gzip/lzf compression (lossless), optionally
+#                  after rounding the float32 mantissa to keepbits bits, which bounds the
+#                  relative error by 2^-(keepbits+1) and makes the data far more compressible.
+#                  Sub-box reads only decompress the chunks they touch.
+# With overdensity=True the field is stored as delta = field/mean - 1, which is what
+# float16 quantization should be applied to. The mean is kept as an attribute in h5
+# and in a sidecar fname_mean.npy for npy, so load_field can restore the field.
+# The rfft modes of a field (tools.py convention, c = rfftn(x)/N) can be cached next to
+# it as fname_k.npy in complex64, so that Fourier-space consumers skip the forward FFT.
+# save_field writes them after the field, or removes a stale cache when none is given,
+# and the cache is only trusted if it is not older than the field.
+
+
+def roundbits(field, keepbits):
+    """ Round float32 values to keepbits mantissa bits (round to nearest) """
+    field = np.ascontiguousarray(field, dtype=np.float32)
+    drop = 23 - keepbits
+    if drop <= 0: return field
+    bits = field.view(np.uint32)
+    half = np.uint32(1 << (drop - 1))
+    mask = np.uint32((0xFFFFFFFF >> drop) << drop)
+    return ((bits + half) & mask).view(np.float32)
+
+
+def _base(fname):
+    """ fname without a .npy or .h5 extension """
+    for ext in ['.npy', '.h5']:
+        if fname.endswith(ext): return fname[:-len(ext)]
+    return fname
+
+
+def save_field(fname, field, dtype='f4', overdensity=False, format='npy', compression='gzip',
+               chunks=64, keepbits=None, modes=None):
+    """ Save field to fname.npy or fname.h5 depending on format, returns the file name.
+    A file of fname in the other format is removed so that load_field cannot pick it up.
+    The rfft modes of the field are cached with save_modes if given, otherwise an
+    existing cache of fname is removed since it no longer matches the field.
+    """
+    field = np.asarray(field)
+    mean = field.mean(dtype=np.float64)
+    if overdensity: field = field/mean - 1
+    if keepbits is not None: field = roundbits(field, keepbits)
+    field = field.astype(dtype, copy=False)
+    if format == 'npy':
+        saved = fname + '.npy'
+        np.save(fname, field)
+        if overdensity: np.save(fname + '_mean', mean)
+        elif os.path.exists(fname + '_mean.npy'): os.remove(fname + '_mean.npy')
+        if os.path.exists(fname + '.h5'): os.remove(fname + '.h5')
+    elif format == 'h5':
+        saved = fname + '.h5'
+        chunks = tuple(min(chunks, n) for n in field.shape)
+        tmp = fname + '.tmp.h5'
+        with h5py.File(tmp, 'w') as f:
+            dset = f.create_dataset('field', data=field, chunks=chunks, shuffle=compression is not None,
+                                    compression=compression)
+            dset.attrs['mean'] = mean
+            dset.attrs['overdensity'] = overdensity
+            if keepbits is not None: dset.attrs['keepbits'] = keepbits
+        os.replace(tmp, saved)
+        for stale in [fname + '.npy', fname + '_mean.npy']:
+            if os.path.exists(stale): os.remove(stale)
+    else: raise Exception('Unknown field format %s'%format)
+    if modes is not None: save_modes(fname, modes)
+    elif os.path.exists(fname + '_k.npy'): os.remove(fname + '_k.npy')
+    return saved
+
+
+def field_exists(fname):
+    fname = _base(fname)
+    return os.path.exists(fname + '.npy') or os.path.exists(fname + '.h5')
+
+
+def load_field(fname, box=None, dtype=None, restore=True):
+    """ Load fname.npy or fname.h5 (fname may also carry the extension).
+    box is a tuple of slices selecting a sub-box, only that part is read.
+    dtype defaults to the stored one (at least float32 when restoring).
+    With restore, fields saved as overdensity are converted back to mean*(1+delta).
+    """
+    if box is None: box = (slice(None),)*3
+    if not fname.endswith('.npy') and not fname.endswith('.h5'):
+        fname = fname + '.npy' if os.path.exists(fname + '.npy') else fname + '.h5'
+    if fname.endswith('.npy'):
+        field = np.load(fname, mmap_mode='r')
+        sidecar = fname[:-4] + '_mean.npy'
+        mean = np.load(sidecar) if restore and os.path.exists(sidecar) else None
+        field = field[box]
+    else:
+        with h5py.File(fname, 'r') as f:
+            dset = f['field']
+            mean = dset.attrs['mean'] if restore and dset.attrs.get('overdensity', False) else None
+            field = dset[box]
+    if dtype is None:
+        dtype = field.dtype if mean is None else np.result_type(field.dtype, np.float32)
+    field = np.array(field, dtype=dtype)
+    if mean is not None:
+        field += 1
+        field *= mean
+    return field
+
+
+def save_modes(fname, modes):
+    """ Cache the rfft modes of the field saved as fname, returns the file name """
+    fname = _base(fname)
+    np.save(fname + '_k', np.asarray(modes).astype(np.complex64, copy=False))
+    return fname + '_k.npy'
+
+
+def modes_exist(fname):
+    """ True if fname has cached modes at least as recent as the saved field """
+    fname = _base(fname)
+    if not os.path.exists(fname + '_k.npy'): return False
+    tmodes = os.path.getmtime(fname + '_k.npy')
+    for ext in ['.npy', '.h5']:
+        if os.path.exists(fname + ext) and os.path.getmtime(fname + ext) > tmodes: return False
+    return True
+
+
+def load_modes(fname, mmap=True):
+    """ Cached rfft modes of fname, memory mapped read-only unless mmap is False """
+    return np.load(_base(fname) + '_k.npy', mmap_mode='r' if mmap else None)
+
+
+def benchmark(nc=256, folder='./', nrep=3, subbox=64, seed=0):
+    """ Storage size, write and read throughput and error of each storage option """
+    np.random.seed(seed)
+    field = np.exp(np.random.normal(size=(nc, nc, nc))*0.5).astype(np.float64)
+    options = [('npy f8', dict(dtype='f8')),
+               ('npy f4', dict(dtype='f4')),
+               ('npy f2 delta', dict(dtype='f2', overdensity=True)),
+               ('h5 f4 gzip', dict(dtype='f4', format='h5')),
+               ('h5 f4 lzf', dict(dtype='f4', format='h5', compression='lzf')),
+               ('h5 f4 12bits gzip', dict(dtype='f4', format='h5', keepbits=12)),
+               ('h5 f2 delta gzip', dict(dtype='f2', overdensity=True, format='h5')),
+               ]
+    box = (slice(0, subbox),)*3
+    print("%20s %10s %10s %12s %12s %12s"%('option', 'MB', 'write s', 'read MB/s', 'subbox ms', 'max relerr'))
+    for name, opts in options:
+        fname = folder + 'benchfield'
+        t0 = time.time()
+        saved = save_field(fname, field, **opts)
+        twrite = time.time() - t0
+        size = os.path.getsize(saved)/1024**2
+        t0 = time.time()
+        for i in range(nrep): loaded = load_field(saved)
+        tread = (time.time() - t0)/nrep
+        t0 = time.time()
+        for i in range(nrep): load_field(saved, box=box)
+        tbox = (time.time() - t0)/nrep
+        err = np.abs(loaded/field - 1).max()
+        print("%20s %10.1f %10.2f %12.1f %12.2f %12.2e"%(name, size, twrite, field.nbytes/1024**2/tread, tbox*1e3, err))
+        os.remove(saved)
+        if os.path.exists(fname + '_mean.npy'): os.remove(fname + '_mean.npy')
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark field storage options.')
+    parser.add_argument('--nc', type=int, default=256, help='mesh size')
+    parser.add_argument('--folder', type=str, default='./', help='folder to write test files to')
+    args = parser.parse_args()
+    benchmark(args.nc, args.folder)
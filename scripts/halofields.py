@@ -0,0 +1,76 @@
+import numpy as np
+import tools
+
+
+#########################################################################################
+# Several halo fields painted in one pass over the catalog.
+# Every derived field (all halos, number density cuts, mass bins, mass weighting) is
+# a weight per halo over the first num halos of the catalog, and tools.paintmulti
+# computes the CIC cell indices and kernel once per chunk of halos and scatters into
+# all the meshes. The catalog is painted in segments between the number density cuts,
+# each into the meshes whose cut covers it, so no halo is painted with a zero weight.
+# compare_pmesh checks the fields and their power against the pmesh painter.
+# Field names follow paint_halos.py: 'field' for all halos, 'field_n%0.0e' for the
+# first numd*bs^3 halos of the catalog (FoF catalogs are ordered by decreasing mass),
+# 'field_mass' for the mass-weighted field and 'field_M%0.2f_%0.2f' for the halos
+# with log10(M) in a bin of massbins (Msun/h).
+
+
+def halo_weights(mass, bs, numds=[], massbins=None, massweighted=False):
+    """ Returns a dict {name: (num, weights)}, the field paints the first num halos
+    (all of them if num is None) with weights, a scalar or one value per halo.
+    """
+    weights = {'field':(None, 1.0)}
+    for numd in numds:
+        weights['field_n%0.0e'%numd] = (int(numd * bs**3), 1.0)
+    if massweighted:
+        weights['field_mass'] = (None, mass.astype(np.float32))
+    if massbins is not None:
+        logm = np.log10(mass)
+        for m0, m1 in zip(massbins[:-1], massbins[1:]):
+            l0, l1 = np.log10(m0), np.log10(m1)
+            weights['field_M%0.2f_%0.2f'%(l0, l1)] = (None, ((logm >= l0) & (logm < l1)).astype(np.float32))
+    return weights
+
+
+def paint_fields(pos, weights, bs, nc, dtype=None):
+    """ CIC paint pos (Mpc/h) with every entry (num, weights) of weights, returns a dict {name: mesh} """
+    names = list(weights.keys())
+    meshes = dict((name, np.zeros((nc, nc, nc), dtype=tools.getdtype(dtype))) for name in names)
+    nhalos = len(pos)
+    nums = dict((name, nhalos if num is None else min(num, nhalos)) for name, (num, w) in weights.items())
+    edges = sorted(set([0, nhalos] + list(nums.values())))
+    for start, stop in zip(edges[:-1], edges[1:]):
+        active = [name for name in names if nums[name] >= stop]
+        ws = [weights[name][1] for name in active]
+        ws = [w if np.isscalar(w) else w[start:stop] for w in ws]
+        tools.paintmulti(pos[start:stop] % bs, [meshes[name] for name in active], ws,
+                         transform=lambda x: x/bs*nc, period=int(nc))
+    return meshes
+
+
+def paint_catalog(FoF, bs, nc, numds=[], massbins=None, massweighted=False, dtype=None):
+    """ Paint the halo fields of a readfof.FoF_catalog, positions in kpc/h and masses in 1e10 Msun/h """
+    pos = FoF.GroupPos/1e3            #Halo positions in Mpc/h
+    mass = FoF.GroupMass*1e10         #Halo masses in Msun/h
+    weights = halo_weights(mass, bs, numds=numds, massbins=massbins, massweighted=massweighted)
+    return paint_fields(pos, weights, bs, nc, dtype=dtype)
+
+
+def compare_pmesh(mesh, pos, weights, fields):
+    """ Largest relative difference of each painted field and of its power spectrum
+    from the same field painted with the pmesh ParticleMesh mesh, {name: (field, power)}
+    """
+    bs = mesh.BoxSize[0]
+    out = {}
+    for name, (num, w) in weights.items():
+        sel = slice(0, num)
+        ref = np.asarray(mesh.paint(pos[sel], mass=w if np.isscalar(w) else w[sel]))
+        field = np.asarray(fields[name], dtype=ref.dtype)
+        efield = np.abs(field - ref).max()/np.abs(ref).max()
+        k, p = tools.power(field, boxsize=bs)
+        k, pref = tools.power(ref, boxsize=bs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            epower = np.nanmax(np.abs(p/pref - 1))
+        out[name] = (efield, epower)
+    return out
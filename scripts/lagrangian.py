@@ -0,0 +1,88 @@
+import numpy as np
+import readgadget
+import os, time
+
+import argparse
+
+
+#########################################################################################
+# Lagrangian displacement field psi(q) = x - q of a snapshot.
+# Particles of an N^3 simulation with IDs 1..N^3 started on the grid
+#   ID - 1 = (i*N + j)*N + k,   q = ((i, j, k) + offset)*bs/N
+# so the displacement of a particle is written straight to row ID-1 of a preallocated
+# (N^3, 3) array, file by file, without sorting the IDs. Displacements are wrapped to
+# [-bs/2, bs/2) for particles that crossed the periodic boundary.
+# Peak memory is the displacement grid plus the positions and IDs of one file; the rms
+# and the reduced precision copy on disk are built one slab at a time.
+
+
+def lagrangian(index, ngrid, bs, offset=0.):
+    """ Initial grid positions of the particles with flat index ID-1 """
+    i, j, k = np.unravel_index(index, (ngrid,)*3)
+    q = np.stack([i, j, k], axis=1).astype(np.float64)
+    q += offset
+    q *= bs/ngrid
+    return q
+
+
+def displacement(snapshot, bs=1000., ptype=[1], ngrid=None, posunit=1e-3, offset=0., dtype=np.float32):
+    """ Displacements (ngrid, ngrid, ngrid, 3) in Mpc/h, positions are multiplied by
+    posunit to get Mpc/h. ngrid defaults to the cube root of the number of particles.
+    """
+    head = readgadget.header(snapshot)
+    npart = int(sum(head.nall[pt] for pt in ptype))
+    if ngrid is None: ngrid = int(round(npart**(1/3.)))
+    if ngrid**3 != npart: raise Exception('%d particles are not on a %d^3 grid'%(npart, ngrid))
+    psi = np.empty((ngrid**3, 3), dtype=dtype)
+    nread = 0
+    for pt, chunk in readgadget.read_chunks(snapshot, ["POS ", "ID  "], ptype):
+        index = chunk["ID  "].astype(np.int64)
+        index -= 1
+        if index.min() < 0 or index.max() >= ngrid**3: raise Exception('IDs outside 1..%d'%ngrid**3)
+        d = chunk["POS "]*posunit - lagrangian(index, ngrid, bs, offset)
+        d += bs/2
+        np.remainder(d, bs, out=d)
+        d -= bs/2
+        psi[index] = d
+        nread += index.size
+    if nread != ngrid**3: raise Exception('Read %d particles for a %d^3 grid'%(nread, ngrid))
+    return psi.reshape(ngrid, ngrid, ngrid, 3)
+
+
+def rms(psi):
+    """ rms displacement, accumulated in float64 one slab of psi at a time """
+    sumsq = sum(np.square(slab, dtype=np.float64).sum() for slab in psi)
+    return np.sqrt(sumsq/(psi.size/3))
+
+
+def save(fname, psi, dtype='f4'):
+    """ Save psi as fname.npy in dtype, casting one slab at a time """
+    if np.dtype(dtype) == psi.dtype:
+        np.save(fname, psi)
+        return
+    out = np.lib.format.open_memmap(fname + '.npy', mode='w+', dtype=dtype, shape=psi.shape)
+    for i, slab in enumerate(psi): out[i] = slab
+    out.flush()
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Lagrangian displacement fields from particle IDs.')
+    parser.add_argument('--snapshot', type=str, help='snapshot path, with %%d for the sim number')
+    parser.add_argument('--savefolder', type=str, help='displacement.npy is saved in savefolder/%%04d/')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=2000, help='last sim')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    parser.add_argument('--offset', type=float, default=0., help='grid offset of the initial positions in cells')
+    parser.add_argument('--dtype', type=str, default='f4', help='precision of saved displacements, f4 or f2')
+    args = parser.parse_args()
+
+    for idd in range(args.id0, args.id1):
+        print(idd)
+        savepath = args.savefolder + '%04d/'%idd
+        os.makedirs(savepath, exist_ok=True)
+        t0 = time.time()
+        psi = displacement(args.snapshot%idd, bs=args.bs, offset=args.offset)
+        save(savepath + 'displacement', psi, dtype=args.dtype)
+        print("%0.1f s, rms displacement %0.2f Mpc/h"%(time.time() - t0, rms(psi)))
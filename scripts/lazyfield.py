@@ -0,0 +1,135 @@
+import numpy as np
+import tools, fftbackend, fieldio
+
+
+#########################################################################################
+# Field that keeps track of whether it is held in real or Fourier space.
+# Fourier-space operators are multiplied into the modes in place, and the field
+# is transformed only when the other representation is asked for, so a chain like
+#
+#   f = Field(mesh, bs).decic().gauss(R).potential()
+#   k, p = f.power()            #from the Fourier modes, no transform
+#   pot = f.real()              #one inverse transform
+#
+# costs a single forward and a single inverse FFT.
+# Modes follow the tools.py convention, c = rfftn(x)/N.
+# Operators modify the field and return it, use copy() to branch a chain.
+
+
+class Field:
+    def __init__(self, value, boxsize, space='real', shape=None, dtype=None):
+        """ value is a real mesh (space='real') or its rfft modes (space='fourier'),
+        in which case the real shape has to be given if it is not a cube.
+        """
+        if space not in ['real', 'fourier']: raise Exception('Unknown space %s'%space)
+        self.boxsize = boxsize
+        self.space = space
+        self.dtype = tools.getdtype(dtype)
+        if space == 'real':
+            self.value = np.asarray(value, dtype=self.dtype)
+            self.shape = self.value.shape
+        else:
+            self.value = np.asarray(value, dtype=np.result_type(self.dtype, np.complex64))
+            self.shape = tuple(shape) if shape is not None else (value.shape[0],)*3
+        self._k = None
+
+
+    @property
+    def k(self):
+        if self._k is None: self._k = tools.fftk(self.shape, self.boxsize, dtype=self.dtype)
+        return self._k
+
+
+    @property
+    def kny(self):
+        return np.pi*self.shape[0]/self.boxsize
+
+
+    def copy(self):
+        new = Field(self.value.copy(), self.boxsize, space=self.space, shape=self.shape, dtype=self.dtype)
+        new._k = self._k
+        return new
+
+
+    def fourier(self):
+        """ rfft modes of the field, transforming if needed """
+        if self.space == 'real':
+            self.value = fftbackend.rfftn(self.value)
+            self.value /= int(np.prod(self.shape))
+            self.space = 'fourier'
+        return self.value
+
+
+    def real(self):
+        """ Real space field, transforming if needed """
+        if self.space == 'fourier':
+            self.value = fftbackend.irfftn(self.value, s=self.shape)
+            self.value *= int(np.prod(self.shape))
+            self.space = 'real'
+        return self.value
+
+
+    def apply(self, kernel):
+        """ Multiply the modes by kernel, an array or a function of the k vectors """
+        if callable(kernel): kernel = kernel(self.k)
+        c = self.fourier()
+        np.multiply(c, kernel, out=c)
+        return self
+
+
+    def gauss(self, R):
+        return self.apply(lambda k: tools.gausskernel(k, R))
+
+
+    def fingauss(self, R):
+        return self.apply(lambda k: tools.fingausskernel(k, R, self.kny))
+
+
+    def tophat(self, R):
+        return self.apply(lambda k: tools.tophatkernel(k, R))
+
+
+    def decic(self, n=2):
+        return self.apply(lambda k: tools.decickernel(k, self.kny, n))
+
+
+    def overdensity(self):
+        """ field/mean - 1, in Fourier space this only rescales the modes """
+        if self.space == 'real':
+            mean = self.value.mean()
+            self.value = self.value/mean - 1
+        else:
+            self.value /= self.value[0, 0, 0].real
+            self.value[0, 0, 0] = 0
+        return self
+
+
+    def potential(self):
+        """ Inverse laplacian of the overdensity, as tools.potential """
+        c = self.fourier()
+        if abs(c[0, 0, 0].real) > 1e-3: self.overdensity()
+        return self.apply(lambda k: tools.laplace(kvec=k))
+
+
+    def power(self, other=None, demean=True, k=None):
+        """ Auto or cross power spectrum from the modes, as tools.power """
+        c1 = self.fourier().copy()
+        c2 = None if other is None else other.fourier().copy()
+        for c in [c1, c2]:
+            if c is None: continue
+            if demean:
+                if abs(c[0, 0, 0].real) < 1e-3: c[0, 0, 0] += 1
+                c /= c[0, 0, 0].real
+            else: c *= int(np.prod(self.shape))
+            c[0, 0, 0] = 0
+        if c2 is None: c2 = c1
+        x = c1.real*c2.real + c1.imag*c2.imag
+        return tools.binpower(x, self.shape, self.boxsize, k=k)
+
+
+
+def load(fname, boxsize, dtype=None):
+    """ Field saved with fieldio, from its cached modes when they exist """
+    if fieldio.modes_exist(fname):
+        return Field(np.array(fieldio.load_modes(fname)), boxsize, space='fourier', dtype=dtype)
+    return Field(fieldio.load_field(fname), boxsize, dtype=dtype)
@@ -0,0 +1,234 @@
+import numpy as np
+import tools, fftbackend, readgadget
+from mpi4py import MPI
+from mpi4py.util.dtlib import from_numpy_dtype
+import time, os
+
+import argparse
+
+
+#########################################################################################
+# Slab-decomposed painting, compensation and power spectra with MPI.
+# Rank r owns the real-space planes x in [r*nslab, (r+1)*nslab) with nslab = nc/size,
+# and after the forward transform the planes ky in [r*nslab, (r+1)*nslab) of the
+# (nc, nc, nc//2+1) rfft grid, which is stored as (kx, ky, kz) = (nc, nslab, nc//2+1).
+# Each rank reads its share of the snapshot subfiles, particles are exchanged to the
+# rank owning their slab, painted with CIC into the slab plus one ghost plane that
+# is added to the next rank, and transformed with a 2D rfft, an all-to-all
+# transpose and a 1D fft along x.
+# Run as e.g.   mpirun -n 4 python mpipaint.py --bench strong --nc 256
+# Modes follow the tools.py convention, c = rfftn(x)/N.
+
+
+class SlabMesh:
+    def __init__(self, nc, bs, comm=None, dtype=np.float32):
+        self.comm = MPI.COMM_WORLD if comm is None else comm
+        self.rank, self.size = self.comm.rank, self.comm.size
+        if nc % self.size: raise Exception('nc=%d not divisible by %d ranks'%(nc, self.size))
+        self.nc, self.bs, self.dtype = nc, bs, np.dtype(dtype)
+        self.cdtype = np.result_type(self.dtype, np.complex64)
+        self.nslab = nc//self.size
+        self.x0 = self.rank*self.nslab
+        self.nch = nc//2 + 1
+        kvec = tools.fftk((nc, nc, nc), bs, dtype=self.dtype)
+        self.k = [kvec[0], kvec[1][:, self.x0:self.x0+self.nslab], kvec[2]]
+
+
+    def _alltoallv(self, send, counts):
+        """ send rows of send (ordered by destination rank) counts[r] rows to rank r """
+        recvcounts = np.empty_like(counts)
+        self.comm.Alltoall(counts, recvcounts)
+        rowsize = int(np.prod(send.shape[1:]))
+        recv = np.empty((recvcounts.sum(),) + send.shape[1:], dtype=send.dtype)
+        sc, rc = counts*rowsize, recvcounts*rowsize
+        sd, rd = np.concatenate([[0], np.cumsum(sc)[:-1]]), np.concatenate([[0], np.cumsum(rc)[:-1]])
+        mpitype = from_numpy_dtype(send.dtype)
+        self.comm.Alltoallv([send, (sc, sd), mpitype], [recv, (rc, rd), mpitype])
+        return recv
+
+
+    def exchange(self, pos, mass=None):
+        """ Send particles (positions in [0, bs)) to the rank owning their slab """
+        ix = np.floor(pos[:, 0]*(self.nc/self.bs)).astype(np.int64) % self.nc
+        owner = ix // self.nslab
+        order = np.argsort(owner, kind='stable')
+        counts = np.bincount(owner, minlength=self.size).astype(np.int64)
+        pos = self._alltoallv(np.ascontiguousarray(pos[order]), counts)
+        if mass is not None and not np.isscalar(mass):
+            mass = self._alltoallv(np.ascontiguousarray(mass[order]), counts)
+        return pos, mass
+
+
+    def paint(self, pos, mass=1.0):
+        """ CIC paint local particles (after exchange) into the local slab """
+        mesh = np.zeros((self.nslab+1, self.nc, self.nc), dtype=self.dtype)
+        shift = np.array([self.x0, 0, 0])
+        transform = lambda x: (x*(self.nc/self.bs)) % self.nc - shift
+        #no wrapping along x, the ghost plane nslab is sent to the next rank
+        period = (self.nslab+2, self.nc, self.nc)
+        tools.paint(pos, mesh, weights=mass, transform=transform, period=period)
+        ghost = np.empty((self.nc, self.nc), dtype=self.dtype)
+        self.comm.Sendrecv(np.ascontiguousarray(mesh[-1]), dest=(self.rank+1) % self.size,
+                           recvbuf=ghost, source=(self.rank-1) % self.size)
+        mesh = mesh[:-1]
+        mesh[0] += ghost
+        return mesh
+
+
+    def r2c(self, real):
+        """ Slab (nslab, nc, nc) to modes (nc, nslab, nch) """
+        n, nc, ns = self.size, self.nc, self.nslab
+        c = fftbackend.rfftn(real, axes=(1, 2)).astype(self.cdtype, copy=False)
+        send = np.ascontiguousarray(c.reshape(ns, n, ns, self.nch).transpose(1, 0, 2, 3))
+        recv = np.empty_like(send)
+        self.comm.Alltoall(send, recv)
+        c = fftbackend.fftn(recv.reshape(nc, ns, self.nch), axes=(0,))
+        c /= nc**3
+        return c
+
+
+    def c2r(self, c):
+        """ Modes (nc, nslab, nch) to slab (nslab, nc, nc) """
+        n, nc, ns = self.size, self.nc, self.nslab
+        c = fftbackend.ifftn(c, axes=(0,)).astype(self.cdtype, copy=False)
+        send = np.ascontiguousarray(c.reshape(n, ns, ns, self.nch))
+        recv = np.empty_like(send)
+        self.comm.Alltoall(send, recv)
+        recv = recv.transpose(1, 0, 2, 3).reshape(ns, nc, self.nch)
+        real = fftbackend.irfftn(recv, s=(nc, nc), axes=(1, 2))
+        real *= nc**3
+        return real.astype(self.dtype, copy=False)
+
+
+    def compensate(self, c, n=2):
+        """ Deconvolve the CIC window in place """
+        c *= tools.decickernel(self.k, np.pi*self.nc/self.bs, n)
+        return c
+
+
+    def power(self, c1, c2=None):
+        """ Auto or cross power of the overdensities, binned as tools.power """
+        means = []
+        for c in [c1, c2]:
+            if c is None: continue
+            means.append(self.comm.bcast(c[0, 0, 0].real if self.rank == 0 else None, root=0))
+        x = c1.real/means[0]
+        y = c1.imag/means[0]
+        if c2 is None: x = x**2 + y**2
+        else: x = x*c2.real/means[1] + y*c2.imag/means[1]
+        del y
+        if self.rank == 0: x[0, 0, 0] = 0
+        kvec = tools.fftk((self.nc,)*3, self.bs, dtype=np.float64)
+        kk = (kvec[0]**2 + kvec[1][:, self.x0:self.x0+self.nslab]**2 + kvec[2]**2)**0.5
+        kmax = self.comm.allreduce(kk.max(), op=MPI.MAX)
+        edges = np.linspace(0, kmax, self.nc+1)
+        H = np.histogram(kk.flat, weights=x.flat, bins=edges)[0]
+        N = np.histogram(kk.flat, bins=edges)[0].astype(np.float64)
+        H, N = self.comm.allreduce(H), self.comm.allreduce(N)
+        power = H*self.bs**3/N
+        power[power == 0] = np.nan
+        return 0.5*(edges[1:] + edges[:-1]), power
+
+
+    def save(self, fname, real):
+        """ Write the slabs of all ranks into a single .npy """
+        if self.rank == 0:
+            np.lib.format.open_memmap(fname, mode='w+', dtype=self.dtype, shape=(self.nc,)*3)
+        self.comm.Barrier()
+        out = np.lib.format.open_memmap(fname, mode='r+')
+        out[self.x0:self.x0+self.nslab] = real
+        out.flush()
+        del out
+        self.comm.Barrier()
+
+
+
+def read_share(snapshot, block, ptype, comm=None):
+    """ Read the subfiles i with i % size == rank of a snapshot """
+    comm = MPI.COMM_WORLD if comm is None else comm
+    filename, fformat = readgadget.fname_format(snapshot)
+    head = readgadget.header(filename)
+    if head.filenum == 1:
+        if comm.rank == 0: return readgadget.read_block(snapshot, block, ptype)
+        return np.zeros((0, 3), dtype=np.float32)
+    arrays = []
+    for i in range(comm.rank, head.filenum, comm.size):
+        if fformat == 'hdf5': fname = '%s.%d.hdf5'%(snapshot, i)
+        else: fname = '%s.%d'%(snapshot, i)
+        for pt in ptype: arrays.append(readgadget.read_field(fname, block, pt))
+    if len(arrays) == 0: return np.zeros((0, 3), dtype=np.float32)
+    return np.concatenate(arrays)
+
+
+
+def paint_snapshot(snapshot, nc, bs, ptype=[1], comm=None, timings=None):
+    """ Distributed read, exchange, paint, compensation and power of a snapshot.
+    Positions are read in kpc/h and bs is in Mpc/h as in paint_snapshot.py.
+    Returns the SlabMesh, the local compensated slab and (k, power).
+    """
+    timings = {} if timings is None else timings
+    t0 = time.time()
+    pm = SlabMesh(nc, bs, comm=comm)
+    pos = read_share(snapshot, "POS ", ptype, comm=pm.comm)/1e3
+    timings['read'] = time.time() - t0
+    return (pm,) + paint_particles(pm, pos, timings=timings)
+
+
+def paint_particles(pm, pos, timings=None):
+    timings = {} if timings is None else timings
+    t0 = time.time()
+    pos, mass = pm.exchange(pos % pm.bs)
+    t1 = time.time()
+    mesh = pm.paint(pos)
+    t2 = time.time()
+    c = pm.compensate(pm.r2c(mesh))
+    t3 = time.time()
+    k, p = pm.power(c)
+    t4 = time.time()
+    real = pm.c2r(c)
+    t5 = time.time()
+    timings.update({'exchange':t1-t0, 'paint':t2-t1, 'fft':t3-t2 + t5-t4, 'power':t4-t3})
+    return real, (k, p)
+
+
+
+def scaling(mode, nc, bs, npart, nrep=2, seed=0):
+    """ Weak (npart per rank) or strong (npart in total) scaling on uniform random particles """
+    comm = MPI.COMM_WORLD
+    pm = SlabMesh(nc, bs, comm=comm)
+    nlocal = npart if mode == 'weak' else npart//comm.size
+    rng = np.random.RandomState(seed + comm.rank)
+    pos = rng.uniform(0, bs, size=(nlocal, 3)).astype(np.float32)
+    for i in range(nrep):
+        comm.Barrier()
+        timings = {}
+        t0 = time.time()
+        paint_particles(pm, pos, timings=timings)
+        timings['total'] = time.time() - t0
+        timings = {key:comm.allreduce(val, op=MPI.MAX) for key, val in timings.items()}
+    if comm.rank == 0:
+        print("%s scaling, ranks=%d nc=%d particles per rank=%d : "%(mode, comm.size, nc, nlocal)
+              + ", ".join("%s %0.3f s"%(key, val) for key, val in timings.items()))
+    return timings
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='MPI slab painting and power spectra.')
+    parser.add_argument('--bench', type=str, default=None, help='weak or strong scaling test on synthetic particles')
+    parser.add_argument('--npart', type=int, default=2*10**6, help='particles in total (strong) or per rank (weak)')
+    parser.add_argument('--snapshot', type=str, default=None, help='snapshot to paint')
+    parser.add_argument('--savepath', type=str, default=None, help='folder to save field.npy and power.npy')
+    parser.add_argument('--nc', type=int, default=1024, help='Nmesh')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    args = parser.parse_args()
+
+    if args.bench is not None:
+        scaling(args.bench, args.nc, args.bs, args.npart)
+    else:
+        pm, real, (k, p) = paint_snapshot(args.snapshot, args.nc, args.bs)
+        if args.savepath is not None:
+            if pm.rank == 0: os.makedirs(args.savepath, exist_ok=True)
+            pm.save(args.savepath + 'field.npy', real)
+            if pm.rank == 0: np.save(args.savepath + 'power', np.stack([k, p]).T)
@@ -0,0 +1,136 @@
+import numpy as np
+import tools, fftbackend, fieldio
+import time
+
+import argparse
+
+
+#########################################################################################
+# One-point PDF and moments of the density field smoothed on a ladder of radii.
+# The overdensity is transformed once, and for every radius the smoothed field is
+# obtained with one inverse FFT into a single reused buffer, histogrammed with a
+# fixed-bin bincount and reduced to its moments before the next radius, so only one
+# smoothed field is held at a time. The histogram is of log10(1 + delta) by default.
+# The feature vector of a field has the fixed length len(radii)*(nbins + 3),
+#   [pdf(R0), ..., pdf(Rn), var(R0..Rn), skew(R0..Rn), kurt(R0..Rn)]
+# with kurt the excess kurtosis.
+
+
+class OnePoint:
+    def __init__(self, nc, boxsize, radii, window='tophat', edges=np.linspace(-1.5, 1.5, 61),
+                 log=True, dtype=np.float32):
+        if window not in ['tophat', 'gauss']: raise Exception('Unknown window %s'%window)
+        self.nc, self.boxsize, self.radii = nc, boxsize, list(radii)
+        self.window, self.log = window, log
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.nbins = self.edges.size - 1
+        self.dtype = np.dtype(dtype)
+        self.k = tools.fftk((nc,)*3, boxsize, dtype=self.dtype)
+
+
+    def kernel(self, R):
+        if self.window == 'tophat': return tools.tophatkernel(self.k, R)
+        return tools.gausskernel(self.k, R)
+
+
+    def counts(self, x):
+        """ Counts of x in the fixed edges, values outside are dropped """
+        lo, width = self.edges[0], self.edges[1] - self.edges[0]
+        index = np.floor((x.ravel() - lo)/width).astype(np.int64)
+        np.clip(index, -1, self.nbins, out=index)
+        index += 1
+        return np.bincount(index, minlength=self.nbins+2)[1:-1]
+
+
+    def histogram(self, x):
+        """ Normalized histogram of x in the fixed edges """
+        return self.counts(x)/(x.size*(self.edges[1] - self.edges[0]))
+
+
+    def moments(self, x):
+        """ Variance, skewness and excess kurtosis of x """
+        x = x.ravel().astype(np.float64)
+        x = x - x.mean()
+        x2 = x*x
+        var = x2.mean()
+        skew = np.dot(x2, x)/x.size/var**1.5
+        kurt = np.dot(x2, x2)/x.size/var**2 - 3
+        return var, skew, kurt
+
+
+    def smoothed(self, field=None, modes=None):
+        """ Yields (R, smoothed overdensity) for every radius from a real field or its
+        cached rfft modes (normalized 1/N). The same buffer is reused for every radius.
+        """
+        if modes is None:
+            field = np.asarray(field, dtype=self.dtype)
+            c = fftbackend.rfftn(field)
+        else: c = np.array(modes)
+        c = c.astype(np.result_type(self.dtype, np.complex64), copy=False)
+        c *= 1/c[0, 0, 0].real
+        c[0, 0, 0] = 0
+        N = self.nc**3
+        smooth = np.empty((self.nc,)*3, dtype=self.dtype)
+        csmooth = np.empty_like(c)
+        for R in self.radii:
+            np.multiply(c, self.kernel(R), out=csmooth)
+            fftbackend.irfftn(csmooth, s=smooth.shape, out=smooth)
+            smooth *= N
+            yield R, smooth
+
+
+    def __call__(self, field=None, modes=None):
+        """ Feature vector of a real field, or of its cached rfft modes (normalized 1/N) """
+        pdfs, moments = [], []
+        for R, smooth in self.smoothed(field, modes):
+            moments.append(self.moments(smooth))
+            if self.log:
+                smooth += 1
+                np.maximum(smooth, 1e-10, out=smooth)
+                np.log10(smooth, out=smooth)
+            pdfs.append(self.histogram(smooth))
+        return np.concatenate(pdfs + [np.array(moments).T.ravel()])
+
+
+    def benchmark(self, field, nrep=1):
+        """ Engine against tools.tophat/gauss and np.histogram per radius """
+        t0 = time.time()
+        for i in range(nrep): out = self(field)
+        t1 = time.time()
+        delta = field/field.mean() - 1
+        for i in range(nrep):
+            for R in self.radii:
+                if self.window == 'tophat': sm = tools.tophat(delta, self.k, R)
+                else: sm = tools.gauss(delta, self.k, R)
+                np.histogram(np.log10(np.maximum(1 + sm, 1e-10)) if self.log else sm, bins=self.edges)
+        t2 = time.time()
+        print("nc=%d, %d radii : engine %0.2f s, per radius filters %0.2f s"%(self.nc, len(self.radii), (t1-t0)/nrep, (t2-t1)/nrep))
+        return out
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='One-point PDF and moments of the smoothed density field.')
+    parser.add_argument('--folder', type=str, default=None, help='folder with one subfolder %%04d/ per sim, benchmark if not given')
+    parser.add_argument('--name', type=str, default='field', help='field to use in each subfolder')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=2000, help='last sim')
+    parser.add_argument('--nc', type=int, default=256, help='Nmesh')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    parser.add_argument('--radii', type=float, nargs='+', default=[10., 15., 20., 30., 40.], help='smoothing radii in Mpc/h')
+    parser.add_argument('--window', type=str, default='tophat', help='tophat or gauss')
+    args = parser.parse_args()
+
+    engine = OnePoint(args.nc, args.bs, args.radii, window=args.window)
+    if args.folder is None:
+        field = np.random.lognormal(0, 0.5, size=(args.nc,)*3).astype(np.float32)
+        engine.benchmark(field)
+    else:
+        for idd in range(args.id0, args.id1):
+            fname = args.folder + '%04d/'%idd + args.name
+            if fieldio.modes_exist(fname): out = engine(modes=fieldio.load_modes(fname))
+            elif fieldio.field_exists(fname): out = engine(fieldio.load_field(fname))
+            else: continue
+            print(idd)
+            np.save(args.folder + '%04d/onepoint_%s'%(idd, args.name), out)
@@ -1,5 +1,5 @@
 import numpy as np
-import tools
+import tools, pyramid, fieldio, halofields, profiling, simindex
 import readgadget, readfof
 from pmesh import ParticleMesh as pmnew
 from nbodykit.lab import FFTPower
@@ -11,7 +11,19 @@ parser = argparse.ArgumentParser(description='Process some integers.')
 parser.add_argument('--id0', type=int, help='sim number to start painting from')
 parser.add_argument('--id1', type=int, default=2000, help='sim number to paint upto')
 parser.add_argument('--z', type=float, help='redshift')
+parser.add_argument('--nlevels', type=int, default=0, help='number of downsampled meshes (nc/2, nc/4, ...) to save alongside each field')
+parser.add_argument('--downsample', type=str, default='fourier', help='pyramid method, fourier or block')
+parser.add_argument('--dtype', type=str, default='f4', help='precision of saved fields, f8, f4 or f2')
+parser.add_argument('--format', type=str, default='npy', help='field storage, npy or h5 (chunked, compressed)')
+parser.add_argument('--keepbits', type=int, default=None, help='round saved float32 fields to this many mantissa bits')
+parser.add_argument('--massbins', type=float, nargs='+', default=None, help='edges of halo mass bins in Msun/h, one field per bin')
+parser.add_argument('--massweighted', action='store_true', help='also save the halo mass weighted field')
+parser.add_argument('--cachek', action='store_true', help='also save the compensated rfft of each field as field_k.npy')
+parser.add_argument('--profile', type=str, default=None, help='append per-sim stage timings to this JSON lines file')
+parser.add_argument('--check', action='store_true', help='compare the painted fields and their power with pmesh painting')
+parser.add_argument('--index', type=str, default=None, help='simindex .npy, only the sims with a FoF catalog at this redshift are painted')
 args = parser.parse_args()
+if args.profile is not None: profiling.enable(args.profile)
 
 ##Setup Mesh 
 bs = 1000 #BoxSize
@@ -22,7 +34,7 @@ cic_kwts = [np.sinc(kvec[i] * bs / (2 * np.pi * nc)) for i in range(3)]
 cic_kwts = (cic_kwts[0] * cic_kwts[1] * cic_kwts[2])**(-2)
 
 
-def cic_compensation(field, kernel=cic_kwts):
+def cic_compensation(field, kernel=cic_kwts, modes=False):
       """
       Does cic compensation with kernel for the field.
       Adapted from https://github.com/bccp/nbodykit/blob/a387cf429d8cb4a07bb19e3b4325ffdf279a131e/nbodykit/source/mesh/catalog.py#L499
@@ -30,19 +42,22 @@ def cic_compensation(field, kernel=cic_kwts):
       `Jing et al 2005 <https://arxiv.org/abs/astro-ph/0409240>`_
       Args:
       kvec: array of k values in Fourier space  
+      modes: if True, also return the compensated modes to cache with fieldio.save_field
       Returns:
-      field_comp: compensated field
+      field_comp: compensated field (and modes)
       """
       cfield = field.r2c() #np.fft.rfftn(field)
       cfield *= kernel
       field_comp = cfield.c2r() #np.fft.irfftn(cfield)
+      if modes: return field_comp, np.asarray(cfield)
       return field_comp
 
 
 ###Setup Quijote
 #snapnum = 2 #4
 redshift = float("%0.1f"%args.z)
-snapnum = int(np.where(np.array([3.0, 2.0, 1.0, 0.5, 0.0]) == redshift)[0])
+index = simindex.load(args.index) if args.index is not None else None
+snapnum = simindex.snapnum(redshift, index)
 print(redshift, snapnum)
 savefolder = "/mnt/ceph/users/cmodi/Quijote/latin_hypercube_HR/FoF/N%04d/z%s/"%(nc, str(redshift))
 path = '/mnt/ceph/users/fvillaescusa/Quijote/Halos/FoF/latin_hypercube/HR_%d//' #folder hosting the catalogue
@@ -50,23 +65,29 @@ path = '/mnt/ceph/users/fvillaescusa/Quijote/Halos/FoF/latin_hypercube/HR_%d//'
 #path = '/mnt/ceph/users/fvillaescusa/Quijote/Halos/FoF/latin_hypercube_nwLH/%d//' #folder hosting the catalogue
 
 
+numds = [1e-3, 5e-4, 1e-4]
 idd = 0
+sims = range(args.id0, args.id1)
+if index is not None:
+      sims = [sim for sim in simindex.query(index, kind='fof', snapnum=snapnum)['sim'] if args.id0 <= sim < args.id1]
 
-for idd in range(args.id0, args.id1):
+for idd in sims:
       print(idd)
+      profiling.start(sim=idd, nc=nc, z=redshift)
       savepath = savefolder + '%04d/'%idd 
       os.makedirs(savepath, exist_ok=True)
       catalog = path%idd
       try:
-            halo_comp = np.load(savepath + 'field.npy')
+            halo_comp = fieldio.load_field(savepath + 'field')
             halo_comp = mesh.create(mode='real', value=halo_comp)
             pk = np.load(savepath + 'power.npy')
             print("%d exists"%idd)
             raise Exception
       except Exception as e:
             print(e)
-            FoF = readfof.FoF_catalog(catalog, snapnum, long_ids=False,
-                                swap=False, SFR=False, read_IDs=False)
+            with profiling.stage('read'):
+                  FoF = readfof.FoF_catalog(catalog, snapnum, long_ids=False,
+                                      swap=False, SFR=False, read_IDs=False)
             pos = FoF.GroupPos/1e3            #Halo positions in Mpc/h
             mass  = FoF.GroupMass*1e10          #Halo masses in Msun/h
             Npart = FoF.GroupLen    
@@ -79,26 +100,39 @@ for idd in range(args.id0, args.id1):
             print("negatives : ", (diff < 0).sum(), (diff < 0).sum()/diff.size)
             #
             
-            halo = mesh.paint(pos)
-            halo_comp = cic_compensation(halo)
-            np.save(savepath + 'field', halo_comp)
-
-            halo_comp = halo_comp / halo_comp.cmean() - 1
-            ps = FFTPower(halo_comp, mode='1d').power.data
-            k, p = ps['k'], ps['power'].real
-            np.save(savepath + 'power', np.stack([k, p]).T)
-            del halo, halo_comp
-                  
-            for numd in [1e-3, 5e-4, 1e-4]:
-                  num = int(numd * bs**3)
-                  print("for number density %0.3e, number of halos is %0.3e"%(numd, num))
-                  halo = mesh.paint(pos[:num])
-                  halo_comp = cic_compensation(halo)
-                  np.save(savepath + 'field_n%0.0e'%numd, halo_comp)
+            #all the fields are painted in a single pass over the halos
+            with profiling.stage('paint'):
+                  halos = halofields.paint_catalog(FoF, bs, nc, numds=numds,
+                                                   massbins=args.massbins, massweighted=args.massweighted)
+            if args.check:
+                  weights = halofields.halo_weights(mass, bs, numds=numds, massbins=args.massbins, massweighted=args.massweighted)
+                  for name, (efield, epower) in halofields.compare_pmesh(mesh, pos, weights, halos).items():
+                        print("%s : max relative difference from pmesh, field %0.2e, power %0.2e"%(name, efield, epower))
+                        if efield > 1e-4 or epower > 1e-4: raise Exception('%s differs from the pmesh painter'%name)
+            for name, halo in halos.items():
+                  if name.startswith('field_n'):
+                        numd = float(name[7:])
+                        print("for number density %0.3e, number of halos is %0.3e"%(numd, int(numd * bs**3)))
+                  with profiling.stage('compensation'):
+                        halo = mesh.create(mode='real', value=halo)
+                        if args.cachek: halo_comp, modes = cic_compensation(halo, modes=True)
+                        else: halo_comp, modes = cic_compensation(halo), None
+                  with profiling.stage('save'):
+                        fieldio.save_field(savepath + name, halo_comp, dtype=args.dtype, format=args.format, keepbits=args.keepbits,
+                                           modes=modes)
+                        del modes
+                  with profiling.stage('pyramid'):
+                        if args.nlevels: pyramid.write_pyramid(savepath, np.asarray(halo_comp), args.nlevels,
+                                                               method=args.downsample, name=name,
+                                                               dtype=args.dtype, format=args.format, keepbits=args.keepbits)
 
                   halo_comp = halo_comp / halo_comp.cmean() - 1
-                  ps = FFTPower(halo_comp, mode='1d').power.data
+                  with profiling.stage('power'):
+                        ps = FFTPower(halo_comp, mode='1d').power.data
                   k, p = ps['k'], ps['power'].real
-                  np.save(savepath + 'power_n%0.0e'%numd, np.stack([k, p]).T)
+                  np.save(savepath + name.replace('field', 'power'), np.stack([k, p]).T)
                   del halo, halo_comp
-            
+            del halos
+      profiling.finish()
+
+profiling.summary()
@@ -1,5 +1,5 @@
 import numpy as np
-import tools
+import tools, pyramid, fieldio, profiling
 import readgadget
 from pmesh import ParticleMesh as pmnew
 from nbodykit.lab import FFTPower
@@ -10,7 +10,15 @@ import argparse
 parser = argparse.ArgumentParser(description='Process some integers.')
 parser.add_argument('--id0', type=int, help='sim number to start painting from')
 parser.add_argument('--id1', type=int, default=2000, help='sim number to paint upto')
+parser.add_argument('--nlevels', type=int, default=0, help='number of downsampled meshes (nc/2, nc/4, ...) to save alongside each field')
+parser.add_argument('--downsample', type=str, default='fourier', help='pyramid method, fourier or block')
+parser.add_argument('--dtype', type=str, default='f4', help='precision of saved fields, f8, f4 or f2')
+parser.add_argument('--format', type=str, default='npy', help='field storage, npy or h5 (chunked, compressed)')
+parser.add_argument('--keepbits', type=int, default=None, help='round saved float32 fields to this many mantissa bits')
+parser.add_argument('--cachek', action='store_true', help='also save the compensated rfft of each field as field_k.npy')
+parser.add_argument('--profile', type=str, default=None, help='append per-sim stage timings to this JSON lines file')
 args = parser.parse_args()
+if args.profile is not None: profiling.enable(args.profile)
 
 ##Setup Mesh 
 bs = 1000 #BoxSize
@@ -21,7 +29,7 @@ cic_kwts = [np.sinc(kvec[i] * bs / (2 * np.pi * nc)) for i in range(3)]
 cic_kwts = (cic_kwts[0] * cic_kwts[1] * cic_kwts[2])**(-2)
 
 
-def cic_compensation(field, kernel=cic_kwts):
+def cic_compensation(field, kernel=cic_kwts, modes=False):
       """
       Does cic compensation with kernel for the field.
       Adapted from https://github.com/bccp/nbodykit/blob/a387cf429d8cb4a07bb19e3b4325ffdf279a131e/nbodykit/source/mesh/catalog.py#L499
@@ -29,12 +37,14 @@ def cic_compensation(field, kernel=cic_kwts):
       `Jing et al 2005 <https://arxiv.org/abs/astro-ph/0409240>`_
       Args:
       kvec: array of k values in Fourier space  
+      modes: if True, also return the compensated modes to cache with fieldio.save_field
       Returns:
-      field_comp: compensated field
+      field_comp: compensated field (and modes)
       """
       cfield = field.r2c() #np.fft.rfftn(field)
       cfield *= kernel
       field_comp = cfield.c2r() #np.fft.irfftn(cfield)
+      if modes: return field_comp, np.asarray(cfield)
       return field_comp
 
 
@@ -51,29 +61,52 @@ col = "POS "
 idd = 0
 for idd in range(args.id0, args.id1):
       print(idd)
+      profiling.start(sim=idd, nc=nc)
       savepath = savefolder + '%04d/'%idd 
       os.makedirs(savepath, exist_ok=True)
       try:
-            dm_comp = np.load(savepath + 'field.npy')
-            dm_comp = mesh.create(mode='real', value=dm_comp)
-            dm_comp = dm_comp/dm_comp.cmean() - 1
+            with profiling.stage('load'):
+                  if fieldio.modes_exist(savepath + 'field'):
+                        #overdensity directly in Fourier space, no forward FFT
+                        c = np.array(fieldio.load_modes(savepath + 'field'))
+                        c /= c[0, 0, 0].real
+                        c[0, 0, 0] = 0
+                        dm_comp = mesh.create(mode='complex', value=c)
+                  else:
+                        dm_comp = fieldio.load_field(savepath + 'field')
+                        dm_comp = mesh.create(mode='real', value=dm_comp)
+                        dm_comp = dm_comp/dm_comp.cmean() - 1
             print("%d exists"%idd)
 
-            ps = FFTPower(dm_comp, mode='1d').power.data
+            with profiling.stage('power'):
+                  ps = FFTPower(dm_comp, mode='1d').power.data
             k, p = ps['k'], ps['power'].real
             np.save(savepath + 'power', np.stack([k, p]).T)
             #pk = np.load(savepath + 'power.npy')
       except Exception as e:
             print(e)
             snapshot = path%idd
-            pos = readgadget.read_block(snapshot, col, ptype)/1e3
-            dm = mesh.paint(pos)
-            dm_comp = cic_compensation(dm)
-            np.save(savepath + 'field', dm_comp)
+            with profiling.stage('read'):
+                  pos = readgadget.read_block(snapshot, col, ptype)/1e3
+            with profiling.stage('paint'):
+                  dm = mesh.paint(pos)
+            with profiling.stage('compensation'):
+                  if args.cachek: dm_comp, modes = cic_compensation(dm, modes=True)
+                  else: dm_comp, modes = cic_compensation(dm), None
+            with profiling.stage('save'):
+                  fieldio.save_field(savepath + 'field', dm_comp, dtype=args.dtype, format=args.format, keepbits=args.keepbits,
+                                     modes=modes)
+                  del modes
+            with profiling.stage('pyramid'):
+                  if args.nlevels: pyramid.write_pyramid(savepath, np.asarray(dm_comp), args.nlevels, method=args.downsample,
+                                                         dtype=args.dtype, format=args.format, keepbits=args.keepbits)
       
             dm_comp = dm_comp/dm_comp.cmean() - 1
-            ps = FFTPower(dm_comp, mode='1d').power.data
+            with profiling.stage('power'):
+                  ps = FFTPower(dm_comp, mode='1d').power.data
             k, p = ps['k'], ps['power'].real
             np.save(savepath + 'power', np.stack([k, p]).T)
             del dm, dm_comp
-            
+      profiling.finish()
+
+profiling.summary()
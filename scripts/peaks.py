@@ -0,0 +1,119 @@
+import numpy as np
+import onepoint, fieldio
+import time
+
+import argparse
+
+
+#########################################################################################
+# Peaks (local maxima) and voids (local minima) of the density field smoothed on a
+# ladder of radii. A cell is a peak if it is not smaller than any of its 26 periodic
+# neighbours, which is the same as being equal to the maximum over its 3x3x3 cube.
+# That maximum is separable, so it is built with three passes of a 3-point maximum
+# along each axis, on whole-array slices and two reused buffers, instead of 26 shifted
+# comparisons. The smoothing is the one of onepoint.OnePoint (one forward FFT and one
+# inverse FFT per radius). Heights are in units of the rms of the smoothed field,
+# nu = delta/sigma_R, unless normalize=False. The feature vector of a field is
+#   [peak counts(R0), ..., peak counts(Rn), void counts(R0), ..., void counts(Rn)]
+# in the bins of edges of nu for the peaks and of -nu for the voids.
+
+
+def _extremum3(x, axis, out, func):
+    """ out = func(x[i-1], x[i], x[i+1]) along a periodic axis """
+    xs, o = np.moveaxis(x, axis, 0), np.moveaxis(out, axis, 0)
+    func(xs[1:], xs[:-1], out=o[1:])
+    func(xs[0], xs[-1], out=o[0])
+    func(o[:-1], xs[1:], out=o[:-1])
+    func(o[-1], xs[0], out=o[-1])
+    return out
+
+
+def extrema(x, minima=False, buffers=None):
+    """ Cell indices (npeaks, 3) and values of the local maxima (or minima) of a
+    periodic 3D field. buffers are two arrays like x to reuse between calls.
+    """
+    func = np.minimum if minima else np.maximum
+    if buffers is None: buffers = np.empty_like(x), np.empty_like(x)
+    b0, b1 = buffers
+    _extremum3(x, 0, b0, func)
+    _extremum3(b0, 1, b1, func)
+    _extremum3(b1, 2, b0, func)
+    index = np.stack(np.nonzero(x == b0), axis=1)
+    return index, x[tuple(index.T)]
+
+
+class Peaks(onepoint.OnePoint):
+    def __init__(self, nc, boxsize, radii, window='gauss', edges=np.linspace(-2, 6, 33),
+                 normalize=True, dtype=np.float32):
+        super().__init__(nc, boxsize, radii, window=window, edges=edges, log=False, dtype=dtype)
+        self.normalize = normalize
+
+
+    def find(self, field=None, modes=None):
+        """ {R: {'peaks':(positions, heights), 'voids':(positions, heights)}} with positions
+        in Mpc/h of the cell corners, from a real field or its cached rfft modes.
+        """
+        out = {}
+        buffers = None
+        cell = self.boxsize/self.nc
+        for R, smooth in self.smoothed(field, modes):
+            if buffers is None: buffers = np.empty_like(smooth), np.empty_like(smooth)
+            if self.normalize: smooth /= smooth.std(dtype=np.float64)
+            out[R] = {}
+            for kind in ['peaks', 'voids']:
+                index, heights = extrema(smooth, minima=(kind == 'voids'), buffers=buffers)
+                out[R][kind] = (index*cell, heights)
+        return out
+
+
+    def __call__(self, field=None, modes=None):
+        """ Feature vector of peak counts in bins of nu and void counts in bins of -nu """
+        found = self.find(field, modes)
+        peaks = [self.counts(found[R]['peaks'][1]) for R in self.radii]
+        voids = [self.counts(-found[R]['voids'][1]) for R in self.radii]
+        return np.concatenate(peaks + voids)
+
+
+    def benchmark(self, field, nrep=1):
+        """ Finder on one smoothed field against 26 np.roll comparisons """
+        x = np.asarray(field, dtype=self.dtype)
+        t0 = time.time()
+        for i in range(nrep): index, heights = extrema(x)
+        t1 = time.time()
+        for i in range(nrep):
+            mask = np.ones(x.shape, dtype=bool)
+            for shift in np.ndindex(3, 3, 3):
+                if shift == (1, 1, 1): continue
+                mask &= x >= np.roll(x, np.array(shift) - 1, axis=(0, 1, 2))
+        t2 = time.time()
+        same = np.array_equal(index, np.stack(np.nonzero(mask), axis=1))
+        print("nc=%d : %d peaks, finder %0.2f s, np.roll %0.2f s, same peaks %s"%(self.nc, len(heights), (t1-t0)/nrep, (t2-t1)/nrep, same))
+        return index, heights
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Peak and void counts of the smoothed density field.')
+    parser.add_argument('--folder', type=str, default=None, help='folder with one subfolder %%04d/ per sim, benchmark if not given')
+    parser.add_argument('--name', type=str, default='field', help='field to use in each subfolder')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=2000, help='last sim')
+    parser.add_argument('--nc', type=int, default=256, help='Nmesh')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    parser.add_argument('--radii', type=float, nargs='+', default=[10., 15., 20., 30.], help='smoothing radii in Mpc/h')
+    parser.add_argument('--window', type=str, default='gauss', help='tophat or gauss')
+    args = parser.parse_args()
+
+    engine = Peaks(args.nc, args.bs, args.radii, window=args.window)
+    if args.folder is None:
+        field = np.random.normal(size=(args.nc,)*3).astype(np.float32)
+        engine.benchmark(field)
+    else:
+        for idd in range(args.id0, args.id1):
+            fname = args.folder + '%04d/'%idd + args.name
+            if fieldio.modes_exist(fname): out = engine(modes=fieldio.load_modes(fname))
+            elif fieldio.field_exists(fname): out = engine(fieldio.load_field(fname))
+            else: continue
+            print(idd)
+            np.save(args.folder + '%04d/peaks_%s'%(idd, args.name), out)
@@ -0,0 +1,147 @@
+import numpy as np
+import json, resource, sys, time
+from contextlib import contextmanager
+from functools import wraps
+
+import argparse
+
+
+#########################################################################################
+# Stage timers and memory high-water marks for the painting scripts.
+#
+#   profiling.enable('profile.jsonl')
+#   profiling.start(sim=idd)
+#   with profiling.stage('read'): pos = ...
+#   profiling.finish()             #appends one JSON line per simulation
+#   profiling.summary()
+#
+# Stages with the same name add up within a record. Memory is the peak resident set
+# size of the process (getrusage), reported after each stage, so the stage where the
+# high-water mark grows is the one that allocated it.
+# Until enable is called, stage returns a shared no-op context and start/finish
+# return immediately, so the calls can stay in production code.
+
+
+def maxrss():
+    """ Peak resident set size of the process in MB """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss/2**20 if sys.platform == 'darwin' else rss/2**10
+
+
+class _Null:
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+
+_null = _Null()
+
+
+class Profiler:
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.records = []
+        self.record = None
+
+    def start(self, **meta):
+        self.record = dict(meta)
+        self.record['stages'] = {}
+        self.t0 = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        if self.record is None: self.start()
+        t0 = time.time()
+        try: yield
+        finally:
+            entry = self.record['stages'].setdefault(name, {'time':0., 'calls':0})
+            entry['time'] += time.time() - t0
+            entry['calls'] += 1
+            entry['maxrss'] = maxrss()
+
+    def finish(self):
+        if self.record is None: return None
+        record, self.record = self.record, None
+        record['total'] = time.time() - self.t0
+        record['maxrss'] = maxrss()
+        self.records.append(record)
+        if self.fname is not None:
+            with open(self.fname, 'a') as f: f.write(json.dumps(record) + '\n')
+        return record
+
+    def summary(self, records=None, out=sys.stdout):
+        """ Mean, min and max time of every stage over the records """
+        records = self.records if records is None else records
+        if not len(records): return {}
+        names = []
+        for record in records:
+            names += [name for name in record['stages'] if name not in names]
+        summary = {}
+        for name in names + ['total']:
+            if name == 'total': tt = np.array([record['total'] for record in records])
+            else: tt = np.array([record['stages'][name]['time'] for record in records if name in record['stages']])
+            summary[name] = {'mean':tt.mean(), 'min':tt.min(), 'max':tt.max(), 'n':tt.size}
+        summary['maxrss'] = max(record['maxrss'] for record in records)
+        if out is not None:
+            for name in names + ['total']:
+                s = summary[name]
+                out.write("%14s : mean %8.3f s, min %8.3f s, max %8.3f s (%d sims)\n"%(name, s['mean'], s['min'], s['max'], s['n']))
+            out.write("%14s : %0.1f MB\n"%('peak memory', summary['maxrss']))
+        return summary
+
+
+
+profiler = None
+
+
+def enable(fname=None):
+    """ Start collecting records, appended as JSON lines to fname if given """
+    global profiler
+    profiler = Profiler(fname)
+    return profiler
+
+
+def disable():
+    global profiler
+    profiler = None
+
+
+def start(**meta):
+    if profiler is not None: profiler.start(**meta)
+
+
+def stage(name):
+    if profiler is None: return _null
+    return profiler.stage(name)
+
+
+def timed(name=None):
+    """ Decorator timing every call of a function as a stage """
+    def decorator(func):
+        label = func.__name__ if name is None else name
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if profiler is None: return func(*args, **kwargs)
+            with profiler.stage(label): return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish():
+    if profiler is not None: return profiler.finish()
+
+
+def summary(out=sys.stdout):
+    if profiler is not None: return profiler.summary(out=out)
+
+
+def load(fname):
+    """ Records of a JSON lines file written by enable """
+    with open(fname) as f: return [json.loads(line) for line in f if line.strip()]
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Summarize profile records written by the painting scripts.')
+    parser.add_argument('fname', type=str, help='JSON lines file')
+    args = parser.parse_args()
+    Profiler().summary(load(args.fname))
@@ -0,0 +1,63 @@
+import numpy as np
+import fftbackend, fieldio
+
+
+#########################################################################################
+# Multi-resolution pyramid of a painted (and compensated) field.
+# Lower resolutions nc/2, nc/4, ... are produced from a single painted mesh
+# either by Fourier truncation (sharp k-space cut at the new Nyquist, one forward
+# FFT shared by all levels) or by averaging blocks of 2^level cells.
+# Both keep the mean of the field, i.e. cells hold averages and not sums.
+
+
+def fourier_downsample(fieldc, nc, ncnew):
+    """ Crop the rfft fieldc of a nc^3 field to ncnew^3 and transform back.
+    Nyquist planes of an even new grid are zeroed to keep the field real, an odd
+    new grid keeps the frequencies -h..h and has no Nyquist plane.
+    """
+    h = ncnew//2
+    ix = np.r_[0:h, nc-h:nc] if ncnew%2 == 0 else np.r_[0:h+1, nc-h:nc]
+    cropped = fieldc[ix][:, ix][:, :, :h+1].copy()
+    if ncnew%2 == 0:
+        cropped[h] = 0
+        cropped[:, h] = 0
+        cropped[:, :, h] = 0
+    return fftbackend.irfftn(cropped, s=(ncnew,)*3) * (ncnew/nc)**3
+
+
+def block_average(field, factor):
+    """ Average non-overlapping blocks of factor^3 cells """
+    nc = field.shape[0]
+    if nc%factor: raise Exception('nc=%d is not divisible by %d'%(nc, factor))
+    n = nc//factor
+    return field.reshape(n, factor, n, factor, n, factor).mean(axis=(1, 3, 5))
+
+
+def build_pyramid(field, nlevels, method='fourier'):
+    """ Returns a dict {nc/2:field, nc/4:field, ...} with nlevels entries """
+    field = np.asarray(field)
+    nc = field.shape[0]
+    if method not in ['fourier', 'block']:
+        raise Exception('Unknown downsampling method %s'%method)
+    if method == 'fourier': fieldc = fftbackend.rfftn(field)
+    pyramid = {}
+    for level in range(1, nlevels+1):
+        ncnew = nc//2**level
+        if ncnew < 2: break
+        if method == 'fourier':
+            pyramid[ncnew] = fourier_downsample(fieldc, nc, ncnew).astype(field.dtype)
+        else:
+            #average the previous level to touch the full mesh only once
+            prev = pyramid[2*ncnew] if level > 1 else field
+            pyramid[ncnew] = block_average(prev, 2)
+    return pyramid
+
+
+def write_pyramid(savepath, field, nlevels, method='fourier', name='field', **saveargs):
+    """ Save the pyramid of field as name_N%04d alongside name, with fieldio.save_field
+    and the same saveargs (dtype, format, keepbits, ...) as the full resolution field.
+    """
+    pyramid = build_pyramid(field, nlevels, method=method)
+    for ncnew, lowres in pyramid.items():
+        fieldio.save_field(savepath + '%s_N%04d'%(name, ncnew), lowres, **saveargs)
+    return pyramid
@@ -173,3 +173,27 @@ def read_block(snapshot, block, ptype, verbose=False):
     if offset!=Ntotal:  raise Exception('not all particles read!!!!')
             
     return array
+
+# This function iterates over the files of a gadget snapshot and yields, for
+# every file and particle type, the particle type and a dictionary {block: array}
+# with the blocks of that file only, so that a snapshot can be processed without
+# loading it whole.
+# E.g. for pt, chunk in read_chunks(snapshot, ["POS ","VEL "], [1]): chunk["POS "]
+def read_chunks(snapshot, blocks, ptype):
+
+    # find the format of the file and read header
+    filename, fformat = fname_format(snapshot)
+    head    = header(filename)
+    filenum = head.filenum
+
+    for i in range(filenum):
+
+        # find the name of the file to read
+        if filenum==1:          fname = filename
+        elif fformat=="binary": fname = '%s.%d'%(snapshot,i)
+        else:                   fname = '%s.%d.hdf5'%(snapshot,i)
+
+        npart = header(fname).npart
+        for pt in ptype:
+            if npart[pt]==0:  continue
+            yield pt, dict((block, read_field(fname, block, pt)) for block in blocks)
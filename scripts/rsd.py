@@ -0,0 +1,123 @@
+import numpy as np
+import tools, fieldio, readgadget
+from lazyfield import Field
+import time, os
+
+import argparse
+
+
+#########################################################################################
+# Mass and momentum fields in real and redshift space from a single pass over a snapshot.
+# The snapshot is streamed file by file with readgadget.read_chunks, and every file is
+# painted in chunks of particles. Redshift-space positions are only ever formed for one
+# chunk at a time,
+#
+#   s = x + v_los (1+z)/H(z)      (Mpc/h, v in km/s, H in km/s/(Mpc/h))
+#
+# with the peculiar velocities of readgadget (already rescaled by sqrt(a)), wrapped
+# periodically. Field names are 'mass', 'px', 'py', 'pz' in real space and the same
+# with an 'rsd_' prefix in redshift space. Masses are in the units of the header
+# (1e10 Msun/h), momenta in 1e10 Msun/h km/s, so px/mass is the mass-weighted velocity.
+# All fields of one space share the CIC kernel through tools.paintmulti.
+
+names = ['mass', 'px', 'py', 'pz']
+
+
+def rsdfactor(head):
+    """ Displacement in Mpc/h per km/s of line-of-sight velocity """
+    return (1. + head.redshift)/head.Hubble
+
+
+def rsdshift(pos, vel, factor, los, bs):
+    """ Move pos (Mpc/h) to redshift space along axis los, returns a new array """
+    s = np.array(pos)
+    s[:, los] += vel[:, los]*factor
+    np.remainder(s, bs, out=s)
+    return s
+
+
+def _weights(fields, mass, vel):
+    weights = []
+    for name in fields:
+        if name == 'mass': weights.append(mass)
+        else: weights.append(mass*vel[:, 'xyz'.index(name[-1])])
+    return weights
+
+
+def paint_stream(snapshot, nc, bs, fields=['mass', 'rsd_mass'], ptype=[1], los=2,
+                 posunit=1e-3, chunksize=2**21, dtype=None, timings=None):
+    """ Paint the requested fields of a snapshot with CIC, without compensation.
+    Positions are multiplied by posunit to get Mpc/h (snapshots are in kpc/h).
+    Returns a dict {name: mesh}.
+    """
+    for name in fields:
+        if name.replace('rsd_', '') not in names: raise Exception('Unknown field %s'%name)
+    timings = {} if timings is None else timings
+    timings.setdefault('read', 0.)
+    timings.setdefault('paint', 0.)
+    head = readgadget.header(snapshot)
+    factor = rsdfactor(head)
+    meshes = dict((name, np.zeros((nc, nc, nc), dtype=tools.getdtype(dtype))) for name in fields)
+    real = [name for name in fields if not name.startswith('rsd_')]
+    rsd = [name for name in fields if name.startswith('rsd_')]
+    needvel = len(rsd) or any(name != 'mass' for name in real)
+    blocks = ["POS ", "VEL "] if needvel else ["POS "]
+    if any(head.massarr[pt] == 0 for pt in ptype): blocks = blocks + ["MASS"]
+    transform = lambda x: x/bs*nc
+
+    t0 = time.time()
+    for pt, chunk in readgadget.read_chunks(snapshot, blocks, ptype):
+        #one particle type of one file
+        pos = chunk["POS "]
+        vel = chunk.get("VEL ")
+        mass = chunk.get("MASS", head.massarr[pt])
+        t1 = time.time()
+        timings['read'] += t1 - t0
+        for start in range(0, len(pos), chunksize):
+            sl = slice(start, start+chunksize)
+            x = np.remainder(pos[sl]*posunit, bs)
+            v = None if vel is None else vel[sl]
+            m = mass if np.isscalar(mass) else mass[sl]
+            if len(real):
+                tools.paintmulti(x, [meshes[name] for name in real], _weights(real, m, v),
+                                 transform=transform, period=nc)
+            if len(rsd):
+                s = rsdshift(x, v, factor, los, bs)
+                tools.paintmulti(s, [meshes[name] for name in rsd],
+                                 _weights([name[4:] for name in rsd], m, v),
+                                 transform=transform, period=nc)
+        t0 = time.time()
+        timings['paint'] += t0 - t1
+    return meshes
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Paint mass and momentum fields in real and redshift space.')
+    parser.add_argument('--snapshot', type=str, help='snapshot path, with %%d for the sim number')
+    parser.add_argument('--savefolder', type=str, help='fields are saved in savefolder/%%04d/')
+    parser.add_argument('--id0', type=int, default=0, help='sim number to start painting from')
+    parser.add_argument('--id1', type=int, default=2000, help='sim number to paint upto')
+    parser.add_argument('--fields', type=str, nargs='+', default=['rsd_mass'], help='mass, px, py, pz, optionally with rsd_ prefix')
+    parser.add_argument('--los', type=int, default=2, help='line of sight axis')
+    parser.add_argument('--nc', type=int, default=256, help='Nmesh')
+    parser.add_argument('--bs', type=float, default=1000., help='BoxSize')
+    parser.add_argument('--dtype', type=str, default='f4', help='precision of saved fields, f8, f4 or f2')
+    parser.add_argument('--format', type=str, default='npy', help='field storage, npy or h5 (chunked, compressed)')
+    args = parser.parse_args()
+
+    for idd in range(args.id0, args.id1):
+        print(idd)
+        savepath = args.savefolder + '%04d/'%idd
+        os.makedirs(savepath, exist_ok=True)
+        timings = {}
+        meshes = paint_stream(args.snapshot%idd, args.nc, args.bs, fields=args.fields,
+                              los=args.los, timings=timings)
+        for name, mesh in meshes.items():
+            field = Field(mesh, args.bs).decic()
+            if name.endswith('mass'):
+                k, p = field.copy().power()
+                np.save(savepath + 'power_%s'%name, np.stack([k, p]).T)
+            fieldio.save_field(savepath + 'field_%s'%name, field.real(), dtype=args.dtype, format=args.format)
+        print(", ".join("%s %0.2f s"%(key, val) for key, val in timings.items()))
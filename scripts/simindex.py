@@ -0,0 +1,168 @@
+import numpy as np
+import readgadget
+import os, time
+from multiprocessing import Pool
+
+import argparse
+
+
+#########################################################################################
+# Metadata index of a simulation suite, so that scripts select sims and snapshots by
+# query instead of probing the filesystem and re-reading headers.
+# Every snapshot and FoF catalog of every sim is scanned once (sims in parallel), each
+# Gadget header with a single read of a structured dtype and each FoF tab header with
+# another, and the result is kept as a numpy structured array with one row per
+# (sim, snapnum, kind), kind 'snap' or 'fof', saved as .npy.
+# Paths are % patterns with the keys sim and snap, e.g. for Quijote
+#   snapshots : .../latin_hypercube_HR/%(sim)d/snapdir_%(snap)03d/snap_%(snap)03d
+#   fof       : .../latin_hypercube_HR/%(sim)d
+# FoF headers carry no redshift, so it is taken from the snapshot of the same sim and
+# snapnum when indexed, otherwise from the list of redshifts of the snapnums.
+#
+#   index = simindex.load('index.npy')
+#   snapnum = simindex.snapnum(1.0, index)
+#   sims = simindex.query(index, kind='fof', snapnum=snapnum)['sim']
+
+QUIJOTE_REDSHIFTS = [3.0, 2.0, 1.0, 0.5, 0.0]
+
+HEADER = np.dtype([('npart', '<i4', 6), ('massarr', '<f8', 6), ('time', '<f8'), ('redshift', '<f8'),
+                   ('sfr', '<i4'), ('feedback', '<i4'), ('nall', '<u4', 6), ('cooling', '<i4'),
+                   ('filenum', '<i4'), ('boxsize', '<f8'), ('omega_m', '<f8'), ('omega_l', '<f8'),
+                   ('hubble', '<f8')])
+
+FOFHEADER = np.dtype([('Ngroups', '<i4'), ('TotNgroups', '<i4'), ('Nids', '<i4'), ('TotNids', '<u8'), ('Nfiles', '<u4')])
+
+INDEX = np.dtype([('sim', 'i4'), ('snapnum', 'i4'), ('kind', 'U4'), ('redshift', 'f8'), ('boxsize', 'f8'),
+                  ('npart', 'u8'), ('mass', 'f8'), ('nfiles', 'i4'), ('omega_m', 'f8'), ('omega_l', 'f8'),
+                  ('hubble', 'f8'), ('nbytes', 'u8'), ('path', 'U256')])
+
+
+def gadget_header(filename):
+    """ Header of a format 1 or 2 Gadget file as a record of HEADER, with the format """
+    with open(filename, 'rb') as f:
+        raw = np.fromfile(f, dtype=np.uint8, count=20 + HEADER.itemsize)
+    blocksize = raw[:4].view('<i4')[0]
+    dtype = HEADER
+    if blocksize not in [8, 256]:
+        blocksize = raw[:4].view('>i4')[0]
+        dtype = HEADER.newbyteorder('>')
+    if blocksize == 256: fformat, offset = 1, 4
+    elif blocksize == 8: fformat, offset = 2, 20
+    else: raise Exception('Incorrect file format in the header of %s'%filename)
+    return raw[offset:offset + HEADER.itemsize].view(dtype)[0], fformat
+
+
+def fof_header(filename):
+    """ Header of a FoF group_tab file as a record of FOFHEADER """
+    return np.fromfile(filename, dtype=FOFHEADER, count=1)[0]
+
+
+def _files(first, nfiles):
+    """ All files of a snapshot from the name of the first one, snap.0 or snap.0.hdf5 """
+    if nfiles == 1: return [first]
+    base, ext = (first[:-5], '.hdf5') if first.endswith('.hdf5') else (first, '')
+    return [base[:-2] + '.%d'%i + ext for i in range(nfiles)]
+
+
+def snapshot_row(snapshot, sim, snapnum, ptype=1):
+    """ Index row (dict) of the snapshot, None if it does not exist """
+    for first in [snapshot, snapshot + '.0', snapshot + '.hdf5', snapshot + '.0.hdf5']:
+        if os.path.exists(first): break
+    else: return None
+    if first.endswith('.hdf5'):
+        head = readgadget.header(first)
+        head = dict((key, getattr(head, key)) for key in ['nall', 'massarr', 'filenum', 'redshift', 'boxsize', 'omega_m', 'omega_l', 'hubble'])
+    else: head = gadget_header(first)[0]
+    nfiles = int(head['filenum'])
+    row = dict((key, head[key]) for key in ['redshift', 'boxsize', 'omega_m', 'omega_l', 'hubble'])
+    row.update(sim=sim, snapnum=snapnum, kind='snap', npart=head['nall'][ptype], mass=head['massarr'][ptype],
+               nfiles=nfiles, nbytes=sum(os.path.getsize(fname) for fname in _files(first, nfiles)), path=snapshot)
+    return row
+
+
+def fof_row(basedir, sim, snapnum, redshifts=QUIJOTE_REDSHIFTS):
+    """ Index row (dict) of the FoF catalog of snapnum in basedir, None if it does not exist.
+    npart is the total number of groups.
+    """
+    prefix = basedir + '/groups_%03d/group_tab_%03d.'%(snapnum, snapnum)
+    if not os.path.exists(prefix + '0'): return None
+    head = fof_header(prefix + '0')
+    nfiles = int(head['Nfiles'])
+    redshift = redshifts[snapnum] if redshifts is not None and snapnum < len(redshifts) else np.nan
+    return dict(sim=sim, snapnum=snapnum, kind='fof', redshift=redshift, boxsize=np.nan, npart=head['TotNgroups'],
+                mass=np.nan, nfiles=nfiles, omega_m=np.nan, omega_l=np.nan, hubble=np.nan,
+                nbytes=sum(os.path.getsize(prefix + '%d'%i) for i in range(nfiles)), path=basedir)
+
+
+def _scan_sim(args):
+    sim, snapshot, fof, snapnums, redshifts = args
+    rows = []
+    for snapnum in snapnums:
+        keys = {'sim':sim, 'snap':snapnum}
+        snaprow = snapshot_row(snapshot%keys, sim, snapnum) if snapshot is not None else None
+        if snaprow is not None: rows.append(snaprow)
+        fofrow = fof_row(fof%keys, sim, snapnum, redshifts) if fof is not None else None
+        if fofrow is not None:
+            if snaprow is not None:
+                fofrow.update((key, snaprow[key]) for key in ['redshift', 'boxsize', 'omega_m', 'omega_l', 'hubble'])
+            rows.append(fofrow)
+    return [tuple(row[key] for key in INDEX.names) for row in rows]
+
+
+def scan(sims, snapshot=None, fof=None, snapnums=range(5), redshifts=QUIJOTE_REDSHIFTS, nworkers=8):
+    """ Index of the snapshots and FoF catalogs of all sims, scanned in parallel """
+    tasks = [(sim, snapshot, fof, list(snapnums), redshifts) for sim in sims]
+    with Pool(nworkers) as pool:
+        rows = [row for sim_rows in pool.map(_scan_sim, tasks, chunksize=max(1, len(tasks)//(4*nworkers))) for row in sim_rows]
+    return np.array(rows, dtype=INDEX)
+
+
+def save(fname, index):
+    np.save(fname, index)
+
+
+def load(fname):
+    return np.load(fname)
+
+
+def query(index, **conditions):
+    """ Rows of the index matching all conditions, column=value (redshifts are compared
+    with a tolerance) or column=function of the column returning a mask.
+    """
+    mask = np.ones(index.size, dtype=bool)
+    for key, value in conditions.items():
+        if callable(value): mask &= value(index[key])
+        elif key == 'redshift': mask &= np.isclose(index[key], value, atol=1e-3)
+        else: mask &= index[key] == value
+    return index[mask]
+
+
+def snapnum(redshift, index=None):
+    """ Snapshot number of redshift, from the index or the Quijote snapshots """
+    if index is None:
+        snaps = np.nonzero(np.isclose(QUIJOTE_REDSHIFTS, redshift, atol=1e-3))[0]
+    else: snaps = np.unique(query(index, redshift=redshift)['snapnum'])
+    if snaps.size != 1: raise Exception('No unique snapnum for redshift %0.2f : %s'%(redshift, snaps))
+    return int(snaps[0])
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Index the snapshots and FoF catalogs of a simulation suite.')
+    parser.add_argument('--snapshot', type=str, default=None, help='snapshot path with %%(sim)d and %%(snap)03d')
+    parser.add_argument('--fof', type=str, default=None, help='FoF directory with %%(sim)d, holding groups_%%03d/')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=2000, help='last sim')
+    parser.add_argument('--snapnums', type=int, nargs='+', default=[0, 1, 2, 3, 4], help='snapshot numbers')
+    parser.add_argument('--nworkers', type=int, default=8, help='number of processes')
+    parser.add_argument('--savepath', type=str, default='./index.npy', help='index file')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    index = scan(range(args.id0, args.id1), snapshot=args.snapshot, fof=args.fof, snapnums=args.snapnums, nworkers=args.nworkers)
+    save(args.savepath, index)
+    print("%d entries in %0.1f s"%(index.size, time.time() - t0))
+    for kind in ['snap', 'fof']:
+        rows = query(index, kind=kind)
+        if rows.size: print("%4s : %d sims, snapnums %s, %0.2f GB"%(kind, np.unique(rows['sim']).size, np.unique(rows['snapnum']), rows['nbytes'].sum()/1e9))
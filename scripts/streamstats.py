@@ -0,0 +1,151 @@
+import numpy as np
+import os
+from multiprocessing import Pool
+
+import argparse
+
+
+#########################################################################################
+# Streaming mean and covariance of feature vectors, e.g. power spectra or wavelet
+# moments of the fiducial realizations, without holding all of them in memory.
+#
+#   stats = RunningStats()
+#   for x in features: stats.update(x)       #one vector or a batch (nsim, nfeatures)
+#   cov, prec = stats.covariance(), stats.precision()
+#
+# Batches are folded in with the pairwise update of Chan et al., which is also how
+# accumulators from parallel workers are combined (merge), so the result does not
+# depend on how the realizations were split. save/load checkpoint the state.
+# The precision matrix is debiased with the Hartlap factor (n - p - 2)/(n - 1).
+
+
+class RunningStats:
+    def __init__(self, n=0, mean=None, m2=None):
+        """ n vectors with mean and m2 = sum of outer products of the deviations """
+        self.n = int(n)
+        self.mean = None if mean is None else np.array(mean, dtype=np.float64)
+        self.m2 = None if m2 is None else np.array(m2, dtype=np.float64)
+
+
+    def _combine(self, n, mean, m2):
+        if n == 0: return self
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n, mean.copy(), m2.copy()
+            return self
+        if mean.shape != self.mean.shape:
+            raise Exception('Feature size %d does not match %d'%(mean.size, self.mean.size))
+        ntot = self.n + n
+        delta = mean - self.mean
+        self.mean += delta*(n/ntot)
+        self.m2 += m2 + np.outer(delta, delta)*(self.n*n/ntot)
+        self.n = ntot
+        return self
+
+
+    def update(self, x):
+        """ Add one feature vector or a batch of shape (nsim, nfeatures) """
+        x = np.asarray(x, dtype=np.float64)
+        x = x.reshape(1, -1) if x.ndim == 1 else x.reshape(x.shape[0], -1)
+        mean = x.mean(axis=0)
+        dx = x - mean
+        return self._combine(x.shape[0], mean, dx.T @ dx)
+
+
+    def merge(self, other):
+        """ Fold in the state of another accumulator, e.g. from another worker """
+        return self._combine(other.n, other.mean, other.m2)
+
+
+    def covariance(self, ddof=1):
+        if self.n <= ddof: raise Exception('Need more than %d vectors for the covariance'%ddof)
+        return self.m2/(self.n - ddof)
+
+
+    def precision(self, hartlap=True):
+        """ Inverse covariance, debiased with the Hartlap factor if hartlap """
+        p = self.mean.size
+        prec = np.linalg.inv(self.covariance())
+        if hartlap:
+            if self.n <= p + 2: raise Exception('Hartlap correction needs more than %d vectors'%(p + 2))
+            prec *= (self.n - p - 2)/(self.n - 1)
+        return prec
+
+
+    def save(self, fname, **extra):
+        """ Save the state and any extra arrays, an empty accumulator has empty mean and m2 """
+        empty = np.zeros(0)
+        np.savez(fname, n=self.n, mean=empty if self.mean is None else self.mean,
+                 m2=empty if self.m2 is None else self.m2, **extra)
+
+
+    @classmethod
+    def load(cls, fname):
+        f = np.load(fname)
+        if int(f['n']) == 0: return cls()
+        return cls(f['n'], f['mean'], f['m2'])
+
+
+
+def loadfeature(fname, feature):
+    """ Feature vector of one simulation saved by the painting scripts """
+    if feature == 'power': return np.load(fname)[:, 1]
+    if feature == 'wavelets':
+        f = np.load(fname)
+        return f['values'][f['index']]
+    return np.load(fname).ravel()
+
+
+def accumulate(fnames, feature='power', checkpoint=None, every=100):
+    """ RunningStats of the features in fnames, missing files are skipped.
+    With checkpoint, the state is saved every 'every' files and at the end, and a run
+    restarts from an existing checkpoint skipping the files it already holds.
+    """
+    stats, start = RunningStats(), 0
+    if checkpoint is not None and os.path.exists(checkpoint):
+        stats, start = RunningStats.load(checkpoint), int(np.load(checkpoint)['nfiles'])
+    batch = []
+    for i in range(start, len(fnames)):
+        if os.path.exists(fnames[i]): batch.append(loadfeature(fnames[i], feature))
+        if (i + 1) % every == 0 or i == len(fnames) - 1:
+            if len(batch): stats.update(np.array(batch))
+            batch = []
+            if checkpoint is not None:
+                stats.save(checkpoint, nfiles=i + 1)
+    return stats
+
+
+def _accumulate(args):
+    return accumulate(*args)
+
+
+def parallel_accumulate(fnames, feature='power', nworkers=4, checkpoint=None):
+    """ Split fnames over nworkers processes and merge their accumulators """
+    chunks = np.array_split(np.arange(len(fnames)), nworkers)
+    jobs = [([fnames[i] for i in chunk], feature, None if checkpoint is None else checkpoint + '.%d.npz'%iw)
+            for iw, chunk in enumerate(chunks)]
+    with Pool(nworkers) as pool:
+        results = pool.map(_accumulate, jobs)
+    stats = RunningStats()
+    for r in results: stats.merge(r)
+    return stats
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Mean, covariance and precision of features over simulations.')
+    parser.add_argument('--folder', type=str, help='folder with one subfolder %%04d/ per sim')
+    parser.add_argument('--fname', type=str, default='power.npy', help='feature file in each subfolder')
+    parser.add_argument('--feature', type=str, default='power', help='power, wavelets or raw (flattened array)')
+    parser.add_argument('--id0', type=int, default=0, help='first sim')
+    parser.add_argument('--id1', type=int, default=15000, help='last sim')
+    parser.add_argument('--nworkers', type=int, default=1, help='number of processes')
+    parser.add_argument('--checkpoint', type=str, default=None, help='checkpoint file prefix')
+    parser.add_argument('--savepath', type=str, default='./covariance', help='saves savepath.npz with mean, cov, prec')
+    args = parser.parse_args()
+
+    fnames = [args.folder + '%04d/'%idd + args.fname for idd in range(args.id0, args.id1)]
+    if args.nworkers > 1: stats = parallel_accumulate(fnames, args.feature, args.nworkers, args.checkpoint)
+    else: stats = accumulate(fnames, args.feature, checkpoint=None if args.checkpoint is None else args.checkpoint + '.npz')
+    print("%d simulations, %d features"%(stats.n, stats.mean.size))
+    np.savez(args.savepath, n=stats.n, mean=stats.mean, cov=stats.covariance(), prec=stats.precision())
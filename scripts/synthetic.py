@@ -0,0 +1,145 @@
+import numpy as np
+import os
+
+import argparse
+
+
+#########################################################################################
+# Synthetic Gadget snapshots and FoF catalogs in the layouts read by readsnap,
+# readgadget and readfof, to run the scripts and benchmarks without Quijote data.
+# Snapshots hold npart dark matter particles (type 1) with uniform positions in kpc/h,
+# gaussian peculiar velocities and IDs 1..npart, split over nfiles files.
+# Velocities are stored as v/sqrt(a), the Gadget convention undone by the readers.
+# FoF catalogs hold ngroups halos sorted by decreasing length, as P-FoF writes them.
+
+
+def _header(npart, nall, massarr, a, nfiles, bs, omega_m=0.3175, omega_l=0.6825, h=0.6711):
+    """ 256 byte Gadget header """
+    head = np.zeros(256, dtype=np.uint8)
+    fields = [np.array(npart, dtype=np.int32), np.array(massarr, dtype=np.float64),
+              np.array([a, 1./a - 1], dtype=np.float64), np.zeros(2, dtype=np.int32),
+              np.array(nall, dtype=np.uint32), np.array([0, nfiles], dtype=np.int32),
+              np.array([bs, omega_m, omega_l, h], dtype=np.float64)]
+    raw = b''.join(field.tobytes() for field in fields)
+    head[:len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+    return head
+
+
+def _particles(npart, bs, seed, sigmav=300.):
+    rng = np.random.RandomState(seed)
+    pos = rng.uniform(0, bs, size=(npart, 3)).astype(np.float32)
+    vel = rng.normal(0, sigmav, size=(npart, 3)).astype(np.float32)
+    ids = np.arange(1, npart+1, dtype=np.uint32)
+    return pos, vel, ids
+
+
+def _split(npart, nfiles):
+    edges = np.linspace(0, npart, nfiles+1).astype(np.int64)
+    return [slice(edges[i], edges[i+1]) for i in range(nfiles)]
+
+
+def write_gadget(snapshot, npart, bs=1e6, nfiles=1, format=1, redshift=0., mass=65., seed=0):
+    """ Format I or II snapshot, written to snapshot (nfiles=1) or snapshot.i.
+    bs in kpc/h and mass in 1e10 Msun/h. Returns the list of files.
+    """
+    if format not in [1, 2]: raise Exception('Gadget format %s not supported'%format)
+    a = 1./(1 + redshift)
+    pos, vel, ids = _particles(npart, bs, seed)
+    fnames = []
+    for i, sl in enumerate(_split(npart, nfiles)):
+        n = sl.stop - sl.start
+        fname = snapshot if nfiles == 1 else '%s.%d'%(snapshot, i)
+        head = _header([0, n, 0, 0, 0, 0], [0, npart, 0, 0, 0, 0], [0, mass, 0, 0, 0, 0], a, nfiles, bs)
+        with open(fname, 'wb') as f:
+            for name, block in [('HEAD', head), ('POS ', pos[sl]), ('VEL ', vel[sl]/np.sqrt(a)), ('ID  ', ids[sl])]:
+                block = np.ascontiguousarray(block)
+                size = np.array([block.nbytes], dtype=np.int32)
+                if format == 2:
+                    np.array([8], dtype=np.int32).tofile(f)
+                    f.write(name.encode())
+                    np.array([block.nbytes + 8, 8], dtype=np.int32).tofile(f)
+                size.tofile(f)
+                block.tofile(f)
+                size.tofile(f)
+        fnames.append(fname)
+    return fnames
+
+
+def write_hdf5(snapshot, npart, bs=1e6, nfiles=1, redshift=0., mass=65., seed=0):
+    """ HDF5 snapshot, written to snapshot.hdf5 (nfiles=1) or snapshot.i.hdf5 """
+    import h5py
+    a = 1./(1 + redshift)
+    pos, vel, ids = _particles(npart, bs, seed)
+    fnames = []
+    for i, sl in enumerate(_split(npart, nfiles)):
+        fname = snapshot + '.hdf5' if nfiles == 1 else '%s.%d.hdf5'%(snapshot, i)
+        with h5py.File(fname, 'w') as f:
+            head = f.create_group('Header')
+            head.attrs['Time'] = a
+            head.attrs['Redshift'] = redshift
+            head.attrs['NumPart_ThisFile'] = np.array([0, sl.stop - sl.start, 0, 0, 0, 0], dtype=np.int32)
+            head.attrs['NumPart_Total'] = np.array([0, npart, 0, 0, 0, 0], dtype=np.uint32)
+            head.attrs['NumFilesPerSnapshot'] = nfiles
+            head.attrs['MassTable'] = np.array([0, mass, 0, 0, 0, 0], dtype=np.float64)
+            head.attrs['BoxSize'] = bs
+            head.attrs['Omega0'] = 0.3175
+            head.attrs['OmegaLambda'] = 0.6825
+            head.attrs['HubbleParam'] = 0.6711
+            f['PartType1/Coordinates'] = pos[sl]
+            f['PartType1/Velocities'] = vel[sl]/np.sqrt(a)
+            f['PartType1/ParticleIDs'] = ids[sl]
+        fnames.append(fname)
+    return fnames
+
+
+def write_fof(basedir, snapnum, ngroups, bs=1e6, nfiles=1, mass=65., minlen=20, seed=0, ids=False):
+    """ group_tab (and group_ids) files of a FoF catalog in basedir/groups_%03d/ """
+    rng = np.random.RandomState(seed)
+    exts = '%03d'%snapnum
+    folder = basedir + '/groups_' + exts + '/'
+    os.makedirs(folder, exist_ok=True)
+    #power-law halo multiplicity above minlen particles
+    length = np.sort((minlen*(1 - rng.uniform(size=ngroups))**(-1/1.9)).astype(np.int32))[::-1]
+    offset = np.concatenate([[0], np.cumsum(length)[:-1]]).astype(np.int32)
+    pos = rng.uniform(0, bs, size=(ngroups, 3)).astype(np.float32)
+    vel = rng.normal(0, 300., size=(ngroups, 3)).astype(np.float32)
+    tlen = np.zeros((ngroups, 6), dtype=np.float32)
+    tlen[:, 1] = length
+    totnids = int(length.sum())
+    fnames = []
+    for i, sl in enumerate(_split(ngroups, nfiles)):
+        ng = sl.stop - sl.start
+        nids = int(length[sl].sum())
+        fname = folder + 'group_tab_%s.%d'%(exts, i)
+        with open(fname, 'wb') as f:
+            np.array([ng, ngroups, nids], dtype=np.int32).tofile(f)
+            np.array([totnids], dtype=np.uint64).tofile(f)
+            np.array([nfiles], dtype=np.uint32).tofile(f)
+            for block in [length, offset, (length*mass).astype(np.float32), pos, vel, tlen, tlen*np.float32(mass)]:
+                np.ascontiguousarray(block[sl]).tofile(f)
+        fnames.append(fname)
+        if ids:
+            start = offset[sl.start] if ng else 0
+            with open(folder + 'group_ids_%s.%d'%(exts, i), 'wb') as f:
+                np.array([ng, ngroups, nids], dtype=np.uint32).tofile(f)
+                np.array([totnids], dtype=np.uint64).tofile(f)
+                np.array([nfiles, start], dtype=np.uint32).tofile(f)
+                np.arange(start + 1, start + nids + 1, dtype=np.uint32).tofile(f)
+    return fnames
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Write synthetic snapshots and FoF catalogs.')
+    parser.add_argument('--folder', type=str, default='./synthetic/', help='output folder')
+    parser.add_argument('--npart', type=int, default=128**3, help='number of particles')
+    parser.add_argument('--ngroups', type=int, default=10**5, help='number of halos')
+    parser.add_argument('--nfiles', type=int, default=8, help='files per snapshot and catalog')
+    args = parser.parse_args()
+
+    os.makedirs(args.folder, exist_ok=True)
+    write_gadget(args.folder + 'snap_format1', args.npart, nfiles=args.nfiles, format=1)
+    write_gadget(args.folder + 'snap_format2', args.npart, nfiles=args.nfiles, format=2)
+    write_hdf5(args.folder + 'snap_hdf5', args.npart, nfiles=args.nfiles)
+    write_fof(args.folder, 4, args.ngroups, nfiles=args.nfiles, ids=True)
@@ -1,5 +1,37 @@
 import numpy as np
 import numpy
+import fftbackend
+import os, functools, time
+from concurrent.futures import ThreadPoolExecutor
+
+
+####################################################################
+# Precision policy. Painting, k vectors, kernels, filters and power spectra
+# work in this precision unless a dtype is passed explicitly to the call.
+# Single precision halves the memory and FFT time of every mesh.
+_dtype = np.float64
+
+
+def set_precision(precision):
+    """ precision is 'single' (float32/complex64) or 'double' (float64/complex128) """
+    global _dtype
+    if precision in ['single', 'float32', 'f4']: _dtype = np.float32
+    elif precision in ['double', 'float64', 'f8']: _dtype = np.float64
+    else: raise Exception('Unknown precision %s'%precision)
+
+
+def getdtype(dtype=None):
+    """ Real dtype of a call, the global precision if dtype is None """
+    if dtype is None: return _dtype
+    return np.dtype(dtype).type
+
+
+def _cast(mesh, k, dtype=None):
+    """ mesh and k vectors in the precision of the call """
+    dtype = getdtype(dtype)
+    mesh = np.asarray(mesh, dtype=dtype)
+    k = [ki.astype(dtype, copy=False) for ki in k]
+    return mesh, k
 
 
 ####################################################################
@@ -24,10 +56,21 @@ def paint(pos, mesh, weights=1.0, mode="raise", period=None, transform=None):
         transform is a function that transforms pos to mesh units:
         transform(pos[:, 3]) -> meshpos[:, 3]
     """
+    return paintmulti(pos, [mesh], [weights], mode=mode, period=period, transform=transform)[0]
+
+
+def paintmulti(pos, meshes, weights, mode="raise", period=None, transform=None):
+    """ CIC paint the same points into several meshes of the same shape at once,
+        with weights[i] (scalar or array) going to meshes[i].
+        Cell indices and the CIC kernel are computed once per chunk and
+        neighbour and shared by all the meshes. Arguments as in paint.
+    """
     pos = numpy.array(pos)
     chunksize = 1024 * 16 * 4
     Ndim = pos.shape[-1]
     Np = pos.shape[0]
+    if len(meshes) != len(weights): raise Exception('Need one weight per mesh')
+    shape = meshes[0].shape
 
     if transform is None:
         transform = lambda x:x
@@ -35,10 +78,7 @@ def paint(pos, mesh, weights=1.0, mode="raise", period=None, transform=None):
             numpy.arange(Ndim)[None, :]) & 1)
     for start in range(0, Np, chunksize):
         chunk = slice(start, start+chunksize)
-        if numpy.isscalar(weights):
-          wchunk = weights
-        else:
-          wchunk = weights[chunk]
+        wchunks = [w if numpy.isscalar(w) else w[chunk] for w in weights]
         gridpos = transform(pos[chunk])
         rmi_mode = 'raise'
         intpos = numpy.intp(numpy.floor(gridpos))
@@ -48,7 +88,6 @@ def paint(pos, mesh, weights=1.0, mode="raise", period=None, transform=None):
             targetpos = intpos + neighbour
 
             kernel = (1.0 - numpy.abs(gridpos - targetpos)).prod(axis=-1)
-            add = wchunk * kernel
 
             if period is not None:
                 period = numpy.int32(period)
@@ -56,35 +95,61 @@ def paint(pos, mesh, weights=1.0, mode="raise", period=None, transform=None):
 
             if len(targetpos) > 0:
                 targetindex = numpy.ravel_multi_index(
-                        targetpos.T, mesh.shape, mode=rmi_mode)
+                        targetpos.T, shape, mode=rmi_mode)
                 u, label = numpy.unique(targetindex, return_inverse=True)
-                mesh.flat[u] += numpy.bincount(label, add, minlength=len(u))
+                for mesh, wchunk in zip(meshes, wchunks):
+                    add = wchunk * kernel
+                    mesh.flat[u] += numpy.bincount(label, add, minlength=len(u))
 
-    return mesh
+    return meshes
 
-def paintcic(pos, bs, nc, mass=1.0, period=True):
-    mesh = np.zeros((nc, nc, nc))
+def paintcic(pos, bs, nc, mass=1.0, period=True, dtype=None):
+    mesh = np.zeros((nc, nc, nc), dtype=getdtype(dtype))
     transform = lambda x: x/bs*nc
     if period: period = int(nc)
     else: period = None
     return paint(pos, mesh, weights=mass, transform=transform, period=period)
 
-def paintnn(pos, bs, nc, mass=1.0, period=True, shift=True):
-    if type(mass) !=  np.ndarray : mass = np.ones(pos.shape[0])
-    bins = np.arange(0, bs+bs/nc, bs/nc)
-    if shift: 
-        posshift = pos + 0.5*bs/nc
-        np.remainder(posshift, bs, posshift)
-        mesh = np.histogramdd(posshift, bins = (bins, bins, bins) , weights=mass)
-    else: mesh = np.histogramdd(pos, bins = (bins, bins, bins) , weights=mass)
-    return mesh[0]
+def paintnn(pos, bs, nc, mass=1.0, period=True, shift=True, chunksize=2**24, dtype=None):
+    """ Nearest grid point painting.
+        Cell indices are computed directly by scaling and flooring, wrapped
+        periodically (or dropped outside the box if not period), and accumulated
+        with np.add.at on flat indices per chunk of particles into the single
+        output mesh.
+        mass can be a scalar or an array of weights.
+        With shift, particles are assigned to the nearest cell center
+        (positions shifted by half a cell), as the histogram version did.
+        Differences from the np.histogramdd version: a scalar mass now scales the
+        mesh (it was ignored), and period is honoured, so with shift=False particles
+        outside the box are wrapped instead of dropped unless period=False.
+    """
+    mesh = np.zeros(nc**3, dtype=getdtype(dtype))
+    scale = nc/bs
+    offset = 0.5 if shift else 0.
+    itype = np.int32 if nc**3 < 2**31 else np.int64
+    for start in range(0, pos.shape[0], chunksize):
+        chunk = slice(start, start+chunksize)
+        cell = np.floor(pos[chunk]*scale + offset).astype(itype)
+        if period or shift:
+            if nc & (nc-1) == 0: np.bitwise_and(cell, nc-1, out=cell)
+            else: np.remainder(cell, nc, out=cell)
+        wchunk = mass if np.isscalar(mass) else mass[chunk]
+        if not (period or shift):
+            inside = ((cell >= 0) & (cell < nc)).all(axis=1)
+            cell = cell[inside]
+            if not np.isscalar(mass): wchunk = wchunk[inside]
+        index = (cell[:, 0]*nc + cell[:, 1])*nc + cell[:, 2]
+        del cell
+        np.add.at(mesh, index, wchunk)
+    return mesh.reshape(nc, nc, nc)
 
 
 #########################################################################################
 
 
-def readhead(path):
-    shape = None
+@functools.lru_cache(maxsize=None)
+def _bighead(path):
+    shape, nmemb = None, 1
     with open(path +'attr-v2') as  f:
         for line in f.readlines():
             if 'ndarray.shape' in line: 
@@ -94,25 +159,94 @@ def readhead(path):
             if 'DTYPE' in line: dtype = line.split()[-1]
             if 'NFILE' in line: nf = int(line.split()[-1])
             if 'NMEMB' in line: 
-                if shape is None: shape = tuple([-1, int(line.split()[-1])])
+                nmemb = int(line.split()[-1])
+                if shape is None: shape = tuple([-1, nmemb])
+    #rows (of nmemb items) in each file
+    itemsize = np.dtype(dtype).itemsize*nmemb
+    nrows = tuple(os.path.getsize(path + '%06d'%i)//itemsize for i in range(nf))
+    return dtype, nf, shape, nmemb, nrows
+
+
+def readhead(path):
+    """ dtype, number of files and shape of a bigfile column, parsed once per path """
+    dtype, nf, shape, nmemb, nrows = _bighead(path)
     return dtype, nf, shape
 
 
-def readbigfile(path):
-    dtype, nf, shape = readhead(path)
-    data = []
-    for i in range(nf): data.append(np.fromfile(path + '%06d'%i, dtype=dtype))
-    data = np.concatenate(data)
-    data = np.reshape(data, shape)
-    return data
+def readbigfile(path, rows=None, columns=None, threads=4, mmap=False, out=None):
+    """
+    Read a bigfile column (path ends with '/').
+    rows = (start, stop) selects a range of rows, columns a list of members
+    (e.g. [0] for x of Position), in which case a (nrows, ncolumns) array is returned.
+    Subfiles are read in parallel threads directly into one preallocated array,
+    or into out if given (C-contiguous, (nrows, ncolumns)).
+    With mmap, a single-file column is memory mapped instead of read.
+    """
+    dtype, nf, shape, nmemb, nrows = _bighead(path)
+    ntot = sum(nrows)
+    start, stop = (0, ntot) if rows is None else rows
+    stop = min(stop, ntot)
+    select = rows is not None or columns is not None
+    ncol = nmemb if columns is None else len(columns)
+
+    if mmap and nf == 1:
+        data = np.memmap(path + '%06d'%0, dtype=dtype, mode='r').reshape(-1, nmemb)[start:stop]
+        if columns is not None: data = data[:, columns]
+        if not select: data = data.reshape(shape)
+        return data
+
+    if out is None: out = np.empty((stop-start, ncol), dtype=dtype)
+    tasks, offset = [], 0
+    for i in range(nf):
+        lo, hi = max(start, offset), min(stop, offset + nrows[i])
+        if hi > lo: tasks.append((i, lo - offset, hi - offset, lo - start))
+        offset += nrows[i]
+
+    def read(task):
+        i, lo, hi, outlo = task
+        with open(path + '%06d'%i, 'rb') as f:
+            f.seek(lo*nmemb*np.dtype(dtype).itemsize)
+            if columns is None:
+                f.readinto(memoryview(out[outlo:outlo+hi-lo]).cast('B'))
+            else:
+                #read in pieces to bound the temporary copy
+                step = 2**20
+                for j in range(lo, hi, step):
+                    n = min(step, hi - j)
+                    tmp = np.fromfile(f, dtype=dtype, count=n*nmemb).reshape(n, nmemb)
+                    out[outlo+j-lo:outlo+j-lo+n] = tmp[:, columns]
+
+    if threads > 1 and len(tasks) > 1:
+        with ThreadPoolExecutor(threads) as pool: list(pool.map(read, tasks))
+    else:
+        for task in tasks: read(task)
+    if not select: return out.reshape(shape)
+    return out
+
+
+def writebigfile(path, data, nfile=1):
+    """ Write data (nrows, nmemb) as a bigfile column with nfile subfiles """
+    os.makedirs(path, exist_ok=True)
+    data = np.asarray(data)
+    if data.ndim == 1: data = data[:, None]
+    nmemb = data.shape[1]
+    edges = np.linspace(0, data.shape[0], nfile+1).astype(int)
+    with open(path + 'header', 'w') as f:
+        f.write('DTYPE: %s\nNMEMB: %d\nNFILE: %d\n'%(data.dtype.str, nmemb, nfile))
+        for i in range(nfile):
+            data[edges[i]:edges[i+1]].tofile(path + '%06d'%i)
+            f.write('%06X: %d : 0 : 0\n'%(i, edges[i+1]-edges[i]))
+    open(path + 'attr-v2', 'w').close()
+    _bighead.cache_clear()
 
 
 
 
 #########################################################################################
-def fftk(shape, boxsize, symmetric=True, finite=False, dtype=np.float64):
+def fftk(shape, boxsize, symmetric=True, finite=False, dtype=None):
     """ return kvector given a shape (nc, nc, nc) and boxsize 
     """
+    dtype = getdtype(dtype)
     k = []
     for d in range(len(shape)):
         kd = numpy.fft.fftfreq(shape[d])
@@ -130,26 +264,26 @@ def fftk(shape, boxsize, symmetric=True, finite=False, dtype=np.float64):
 
 
 
-def laplace(bs=None, nc=None, kvec=None, symmetric=True):
+def laplace(bs=None, nc=None, kvec=None, symmetric=True, dtype=None):
     if kvec is None:
         if nc is None or bs is None:
             print('Need either a k vector or bs & nc')
             return None
-        else: kvec = fftk((nc, nc, nc), bs, symmetric=symmetric)
+        else: kvec = fftk((nc, nc, nc), bs, symmetric=symmetric, dtype=dtype)
 
     kk = sum(ki**2 for ki in kvec)
     mask = (kk == 0).nonzero()
     kk[mask] = 1
     wts = 1/kk
-    imask = (~(kk==0)).astype(int)
+    imask = (~(kk==0)).astype(kk.dtype)
     wts *= imask
     return wts
 
 
 
-def gradient(dir, bs, nc, kvec=None, finite=True, symmetric=True):
+def gradient(dir, bs, nc, kvec=None, finite=True, symmetric=True, dtype=None):
     if kvec is None:
-        kvec = fftk((nc, nc, nc), bs, symmetric=symmetric)
+        kvec = fftk((nc, nc, nc), bs, symmetric=symmetric, dtype=dtype)
 
     cellsize = bs/nc
     w = kvec[dir] * cellsize
@@ -160,61 +294,80 @@ def gradient(dir, bs, nc, kvec=None, finite=True, symmetric=True):
     return wts
 
 
-def potential(mesh, k, symmetric=True):
+def potential(mesh, k, symmetric=True, dtype=None):
+    mesh, k = _cast(mesh, k, dtype)
     if abs(mesh.mean()) > 1e-3:
         ovd = (mesh-mesh.mean())/mesh.mean()
     else: ovd = mesh.copy()
     lap = laplace(kvec = k, symmetric=symmetric)
 
     if not symmetric:
-        ovdc = np.fft.fftn(ovd)/np.prod(mesh.shape)
+        ovdc = fftbackend.fftn(ovd)/mesh.size
         potc = ovdc*lap
-        pot =  np.fft.ifftn(potc)*np.prod(mesh.shape)
+        pot =  fftbackend.ifftn(potc)*mesh.size
     else:
-        ovdc = np.fft.rfftn(ovd)/np.prod(mesh.shape)
+        ovdc = fftbackend.rfftn(ovd)/mesh.size
         potc = ovdc*lap
-        pot =  np.fft.irfftn(potc)*np.prod(mesh.shape)
+        pot =  fftbackend.irfftn(potc, s=mesh.shape)*mesh.size
     return pot
     
 
 
 
-def gauss(mesh, k, R):
+def gausskernel(k, R):
     kmesh = sum([i ** 2 for i in k])**0.5
-    meshc = np.fft.rfftn(mesh)/np.prod(mesh.shape)
-    wts = np.exp(-0.5*kmesh**2*(R**2))
-    meshc = meshc*wts
-    return np.fft.irfftn(meshc)*np.prod(mesh.shape)
+    return np.exp(-0.5*kmesh**2*(R**2))
 
 
-def fingauss(mesh, k, R, kny):
+def fingausskernel(k, R, kny):
     kmesh = sum(((2*kny/np.pi)*np.sin(ki*np.pi/(2*kny)))**2  for ki in k)**0.5
-    meshc = np.fft.rfftn(mesh)/np.prod(mesh.shape)
-    wts = np.exp(-0.5*kmesh**2*(R**2))
-    meshc = meshc*wts
-    return np.fft.irfftn(meshc)*np.prod(mesh.shape)
-
+    return np.exp(-0.5*kmesh**2*(R**2))
 
 
-def tophat(mesh, k, R):
+def tophatkernel(k, R):
     kmesh = sum([i ** 2 for i in k])**0.5
-    meshc = np.fft.rfftn(mesh)/np.prod(mesh.shape)
     kr = R * kmesh
-    kr[kr==0] = 1
+    zero = kr==0
+    kr[zero] = 1
     wt = 3 * (np.sin(kr)/kr - np.cos(kr))/kr**2
-    wt[kr==0] = 1        
-    meshc = meshc*wt
-    return np.fft.irfftn(meshc)*np.prod(mesh.shape)
-
+    wt[zero] = 1        
+    return wt
 
 
-def decic(mesh, k, kny, n=2):
+def decickernel(k, kny, n=2):
     kmesh = [np.sinc(k[i]/(2*kny)) for i in range(3)]
-    wts = (kmesh[0]*kmesh[1]*kmesh[2])**(-1*n)
-        
-    meshc = np.fft.rfftn(mesh)/np.prod(mesh.shape)
-    meshc = meshc*wts
-    return np.fft.irfftn(meshc)*np.prod(mesh.shape)
+    return (kmesh[0]*kmesh[1]*kmesh[2])**(-1*n)
+
+
+
+def gauss(mesh, k, R, dtype=None):
+    mesh, k = _cast(mesh, k, dtype)
+    meshc = fftbackend.rfftn(mesh)/mesh.size
+    meshc = meshc*gausskernel(k, R)
+    return fftbackend.irfftn(meshc, s=mesh.shape)*mesh.size
+
+
+def fingauss(mesh, k, R, kny, dtype=None):
+    mesh, k = _cast(mesh, k, dtype)
+    meshc = fftbackend.rfftn(mesh)/mesh.size
+    meshc = meshc*fingausskernel(k, R, kny)
+    return fftbackend.irfftn(meshc, s=mesh.shape)*mesh.size
+
+
+
+def tophat(mesh, k, R, dtype=None):
+    mesh, k = _cast(mesh, k, dtype)
+    meshc = fftbackend.rfftn(mesh)/mesh.size
+    meshc = meshc*tophatkernel(k, R)
+    return fftbackend.irfftn(meshc, s=mesh.shape)*mesh.size
+
+
+
+def decic(mesh, k, kny, n=2, dtype=None):
+    mesh, k = _cast(mesh, k, dtype)
+    meshc = fftbackend.rfftn(mesh)/mesh.size
+    meshc = meshc*decickernel(k, kny, n)
+    return fftbackend.irfftn(meshc, s=mesh.shape)*mesh.size
 
 
 
@@ -247,18 +400,21 @@ def diracdelta(i, j):
     else: return 0
 
 
-def shear(mesh, k):
+def shear(mesh, k, dtype=None):
     '''Takes in a PMesh object in real space. Returns am array of shear'''          
+    mesh, k = _cast(mesh, k, dtype)
     k2 = sum([i ** 2 for i in k])
     k2[0, 0, 0] = 1
-    meshc = np.fft.rfftn(mesh)/np.prod(mesh.shape)
+    meshc = fftbackend.rfftn(mesh)/mesh.size
     s2 = np.zeros_like(mesh)
+    basec = np.empty_like(meshc)
+    baser = np.empty(mesh.shape, dtype=s2.dtype)
 
     for i in range(3):
         for j in range(i, 3):                                                       
-            basec = meshc.copy()
-            basec *= (k[i]*k[j] / k2 - diracdelta(i, j)/3.)              
-            baser = np.fft.irfftn(basec)*np.prod(mesh.shape)                                                                
+            np.multiply(meshc, (k[i]*k[j] / k2 - diracdelta(i, j)/3.), out=basec)
+            fftbackend.irfftn(basec, s=mesh.shape, out=baser)
+            baser *= mesh.size
             s2[...] += baser**2                                                        
             if i != j:                                                              
                 s2[...] += baser**2                                                
@@ -270,11 +426,13 @@ def shear(mesh, k):
 #################################################################################
 
 
-def power(f1, f2=None, boxsize=1.0, k = None, symmetric=True, demean=True, eps=1e-9):
+def power(f1, f2=None, boxsize=1.0, k = None, symmetric=True, demean=True, eps=1e-9, dtype=None):
     """
     Calculate power spectrum given density field in real space & boxsize.
     Divide by mean, so mean should be non-zero
     """
+    f1 = np.asarray(f1, dtype=getdtype(dtype))
+    if f2 is not None: f2 = np.asarray(f2, dtype=getdtype(dtype))
     if demean and abs(f1.mean()) < 1e-3:
         print('Add 1 to get nonzero mean of %0.3e'%f1.mean())
         f1 = f1*1 + 1
@@ -283,13 +441,13 @@ def power(f1, f2=None, boxsize=1.0, k = None, symmetric=True, demean=True, eps=1
             print('Add 1 to get nonzero mean of %0.3e'%f2.mean())
             f2 =f2*1 + 1
     
-    if symmetric: c1 = numpy.fft.rfftn(f1)
-    else: c1 = numpy.fft.fftn(f1)
+    if symmetric: c1 = fftbackend.rfftn(f1)
+    else: c1 = fftbackend.fftn(f1)
     if demean : c1 /= c1[0, 0, 0].real
     c1[0, 0, 0] = 0
     if f2 is not None:
-        if symmetric: c2 = numpy.fft.rfftn(f2)
-        else: c2 = numpy.fft.fftn(f2)
+        if symmetric: c2 = fftbackend.rfftn(f2)
+        else: c2 = fftbackend.fftn(f2)
         if demean : c2 /= c2[0, 0, 0].real
         c2[0, 0, 0] = 0
     else:
@@ -298,10 +456,18 @@ def power(f1, f2=None, boxsize=1.0, k = None, symmetric=True, demean=True, eps=1
     x = c1.real* c2.real + c1.imag*c2.imag
     del c1
     del c2
+    return binpower(x, f1.shape, boxsize, k=k, symmetric=symmetric)
+
+
+def binpower(x, shape, boxsize, k=None, symmetric=True):
+    """
+    Average the mode powers x (on the rfft grid if symmetric) in shape[0] bins of |k|
+    """
     if k is None:
-        k = fftk(f1.shape, boxsize, symmetric=symmetric)
+        #bin in double precision, modes on bin edges are otherwise assigned differently
+        k = fftk(shape, boxsize, symmetric=symmetric, dtype=np.float64)
         k = sum(kk**2 for kk in k)**0.5
-    H, edges = numpy.histogram(k.flat, weights=x.flat, bins=f1.shape[0]) 
+    H, edges = numpy.histogram(k.flat, weights=x.flat, bins=shape[0]) 
     N, edges = numpy.histogram(k.flat, bins=edges)
     center= edges[1:] + edges[:-1]
     power = H *boxsize**3 / N
@@ -332,3 +498,93 @@ def get_ps(iterand, truth, bs):
     pks.append([p1, p2, p12])
 
     return k, pks
+
+
+#################################################################################
+
+
+def precision_check(nc=128, bs=1000., npart=2*10**6, seed=0):
+    """
+    Regression check of the single precision mode: paint the same clustered
+    particles in float32 and float64 and return k and the relative P(k) difference.
+    """
+    np.random.seed(seed)
+    centers = np.random.uniform(0, bs, size=(npart//100, 3))
+    pos = (np.repeat(centers, 100, axis=0) + np.random.normal(scale=0.02*bs, size=(npart, 3))) % bs
+    pos = pos.astype(np.float32)
+    pks = []
+    for dtype in [np.float64, np.float32]:
+        mesh = paintcic(pos, bs, nc, dtype=dtype)
+        k = fftk(mesh.shape, bs, dtype=dtype)
+        mesh = decic(mesh, k, np.pi*nc/bs, dtype=dtype)
+        pks.append(power(mesh, boxsize=bs, dtype=dtype))
+    (k, p64), (k32, p32) = pks
+    return k, p32/p64 - 1
+
+
+
+def bench_readbigfile(path, nrows=5*10**7, nfile=16, threads=4, nrep=3):
+    """
+    Time readbigfile against the previous implementation (fromfile per subfile,
+    concatenate, reshape) on a synthetic Position column.
+    """
+    np.random.seed(0)
+    writebigfile(path, np.random.uniform(0, 1000, size=(nrows, 3)).astype(np.float32), nfile=nfile)
+
+    def legacy(path):
+        dtype, nf, shape = readhead(path)
+        data = []
+        for i in range(nf): data.append(np.fromfile(path + '%06d'%i, dtype=dtype))
+        return np.reshape(np.concatenate(data), shape)
+
+    runs = [('legacy', lambda: legacy(path)),
+            ('readbigfile', lambda: readbigfile(path, threads=threads)),
+            ('rows 1/4', lambda: readbigfile(path, rows=(0, nrows//4), threads=threads)),
+            ('column x', lambda: readbigfile(path, columns=[0], threads=threads))]
+    nbytes = nrows*3*4
+    for name, run in runs:
+        t0 = time.time()
+        for i in range(nrep): run()
+        tt = (time.time() - t0)/nrep
+        print("%12s : %0.3f s, %0.1f MB/s of the full column"%(name, tt, nbytes/tt/1024**2))
+
+
+
+def bench_paintnn(npart=10**7, nc=256, bs=1000., nrep=3):
+    """ Time paintnn against np.histogramdd on uniform random particles """
+    np.random.seed(0)
+    pos = np.random.uniform(0, bs, size=(npart, 3)).astype(np.float32)
+
+    def legacy(pos):
+        mass = np.ones(pos.shape[0])
+        bins = np.arange(0, bs+bs/nc, bs/nc)
+        posshift = pos + 0.5*bs/nc
+        np.remainder(posshift, bs, posshift)
+        return np.histogramdd(posshift, bins = (bins, bins, bins) , weights=mass)[0]
+
+    for name, run in [('histogramdd', legacy), ('paintnn', lambda x: paintnn(x, bs, nc))]:
+        t0 = time.time()
+        for i in range(nrep): mesh = run(pos)
+        tt = (time.time() - t0)/nrep
+        print("%12s : %0.3f s, %0.2e particles/s"%(name, tt, npart/tt))
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Checks and benchmarks of tools.py')
+    parser.add_argument('--check', type=str, default='precision', help='precision, bigfile or paintnn')
+    parser.add_argument('--path', type=str, default='./benchbigfile/Position/', help='where to write the synthetic bigfile')
+    parser.add_argument('--nrows', type=int, default=5*10**7, help='number of rows in the synthetic bigfile')
+    args = parser.parse_args()
+
+    if args.check == 'precision':
+        k, diff = precision_check()
+        diff = np.abs(diff[np.isfinite(diff)])
+        print("float32 vs float64 P(k): max relative difference %0.2e, mean %0.2e"%(diff.max(), diff.mean()))
+        assert diff.max() < 1e-4
+    elif args.check == 'bigfile':
+        bench_readbigfile(args.path, nrows=args.nrows)
+    elif args.check == 'paintnn':
+        bench_paintnn()
@@ -0,0 +1,154 @@
+import numpy as np
+import hashlib, json, os
+
+
+#########################################################################################
+# Feature transform pipeline.
+# Steps are declared as tuples, e.g.
+#
+#   steps = [('select', (slice(None), [6, 8])), ('select', slice(0, 20)),
+#            ('reshape',), ('log10',), ('standardize',)]
+#   pipe = Pipeline(steps, cachedir='../data/cache/')
+#   x_train = pipe.fit_transform(w_lh[train])     #fits, caches on disk
+#   x_test = pipe.transform(w_lh[test])           #same fitted transform
+#
+# 'select' indexes every axis but the first (the simulation axis), 'reshape'
+# flattens to (nsim, -1), 'log10' and 'standardize' act elementwise/columnwise.
+# The fitted state (mean and scale for 'standardize') is stored with the cached
+# array so that a cache hit also restores the transform for new observations.
+
+
+def _encode(obj):
+    """ json friendly version of a step argument, used for hashing """
+    if isinstance(obj, slice): return ['slice', obj.start, obj.stop, obj.step]
+    if isinstance(obj, (tuple, list)): return [_encode(i) for i in obj]
+    if isinstance(obj, np.ndarray): return obj.tolist()
+    if isinstance(obj, np.generic): return obj.item()
+    return obj
+
+
+def hasharray(x):
+    """ sha1 of the shape, dtype and data of an array """
+    x = np.ascontiguousarray(x)
+    h = hashlib.sha1()
+    h.update(str((x.shape, x.dtype.str)).encode())
+    h.update(x.data)
+    return h.hexdigest()
+
+
+def _fresh(cached, fname):
+    """ cached exists and is not older than fname """
+    return os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(fname)
+
+
+def loadnpz(fname, key=None, cachedir=None):
+    """ Load a (possibly pickled) npz and cache its arrays as plain .npy files in cachedir,
+    so that later loads are memory-mapped and skip unpickling. Cached arrays older than
+    the npz are rewritten. Without cachedir, or if it is not writable, this is np.load.
+    """
+    if cachedir is not None:
+        name = os.path.basename(fname)[:-4] + '_' + hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()[:8]
+        cache = os.path.join(cachedir, name) + '/'
+        if key is not None and _fresh(cache + key + '.npy', fname):
+            return np.load(cache + key + '.npy', mmap_mode='r')
+    f = np.load(fname, allow_pickle=True)
+    if cachedir is not None:
+        try:
+            os.makedirs(cache, exist_ok=True)
+            for k in f.files:
+                if f[k].dtype != object and not _fresh(cache + k + '.npy', fname):
+                    np.save(cache + k + '.tmp.npy', f[k])
+                    os.replace(cache + k + '.tmp.npy', cache + k + '.npy')
+        except OSError as e: print('Not caching %s in %s : %s'%(fname, cachedir, e))
+    if key is None: return f
+    return f[key]
+
+
+class Pipeline:
+    def __init__(self, steps, cachedir=None, eps=1e-30):
+        """ steps is a list of tuples (name, *args), see top of the module.
+        If cachedir is given, transformed training arrays and fitted states are
+        stored there, keyed by a hash of (input, steps).
+        """
+        self.steps = [tuple(s) if isinstance(s, (tuple, list)) else (s,) for s in steps]
+        for s in self.steps:
+            if s[0] not in ['select', 'reshape', 'log10', 'standardize']:
+                raise Exception('Unknown transform step %s'%s[0])
+        self.cachedir = cachedir
+        self.eps = eps
+        self.state = None
+        self.key = None
+
+
+    def stepkey(self):
+        return json.dumps(_encode(self.steps))
+
+
+    def _apply(self, x, fit=False):
+        state = [] if fit else self.state
+        for i, step in enumerate(self.steps):
+            name = step[0]
+            if name == 'select':
+                idx = step[1] if isinstance(step[1], tuple) else (step[1],)
+                x = x[(slice(None),) + idx]
+            elif name == 'reshape':
+                x = x.reshape(x.shape[0], -1)
+            elif name == 'log10':
+                x = np.log10(x)
+            elif name == 'standardize':
+                if fit:
+                    mean = x.mean(axis=0)
+                    scale = x.std(axis=0)
+                    scale[scale < self.eps] = 1.
+                    state.append((mean, scale))
+                else:
+                    mean, scale = self.state[len([s for s in self.steps[:i] if s[0] == 'standardize'])]
+                x = (x - mean)/scale
+        if fit: self.state = state
+        return np.asarray(x)
+
+
+    def fit_transform(self, x, key=None):
+        """ Fit the pipeline on x and return the transformed array.
+        key identifies the dataset version, defaults to a hash of x.
+        A cache hit skips both the fit and the transform.
+        """
+        if key is None: key = hasharray(x)
+        self.key = hashlib.sha1((key + self.stepkey()).encode()).hexdigest()
+        if self.cachedir is not None:
+            fname = os.path.join(self.cachedir, self.key + '.npz')
+            if os.path.exists(fname):
+                self.load(fname)
+                return self.cached
+        xt = self._apply(np.asarray(x), fit=True)
+        if self.cachedir is not None:
+            os.makedirs(self.cachedir, exist_ok=True)
+            self.save(fname, xt)
+        return xt
+
+
+    def transform(self, x):
+        """ Apply the fitted pipeline to new observations """
+        if self.state is None: raise Exception('Pipeline has not been fit')
+        return self._apply(np.asarray(x))
+
+
+    def save(self, fname, xt=None):
+        arrays = {'steps':np.array(self.stepkey())}
+        for i, (mean, scale) in enumerate(self.state):
+            arrays['mean%d'%i] = mean
+            arrays['scale%d'%i] = scale
+        if xt is not None: arrays['transformed'] = xt
+        tmp = fname[:-4] + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, fname)
+
+
+    def load(self, fname):
+        f = np.load(fname)
+        if str(f['steps']) != self.stepkey():
+            raise Exception('Cached steps do not match the pipeline')
+        nstate = len([s for s in self.steps if s[0] == 'standardize'])
+        self.state = [(f['mean%d'%i], f['scale%d'%i]) for i in range(nstate)]
+        self.cached = f['transformed'] if 'transformed' in f.files else None
+        return self
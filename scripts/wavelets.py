@@ -0,0 +1,292 @@
+import numpy as np
+import tools, fieldio, fftbackend
+from math import factorial
+import time
+
+import argparse
+
+
+#########################################################################################
+# Solid harmonic wavelet moments of 3D fields.
+# The wavelet at scale j and order l is a solid harmonic times a gaussian,
+#   psi_jlm(x) ~ |x|^l Y_lm(x/|x|) exp(-|x|^2/(2 sigma_j^2)),   sigma_j = sigma*2^j,
+# whose Fourier transform is again a solid harmonic times a gaussian,
+#   psi_jlm(k) = (-i)^l sigma_j^l R_lm(k) exp(-sigma_j^2 |k|^2/2).
+# With real harmonics R_lm the filtered fields are real and can be computed with
+# irfftn. The modulus U_jl = (sum_m |field * psi_jlm|^2)^0.5 is rotation invariant
+# and the moments are sum_x U_jl^q for every integral power q.
+# Output is ordered as (len(L)*len(J), len(powers)) with L the slow index,
+# the same layout as the quijote_harmonic_rings files.
+
+
+def solidharmonics(kvec, lmax, dtype=np.float32):
+    """ Real regular solid harmonics R_lm(k) = |k|^l Y_lm(k/|k|) for l <= lmax,
+    normalized so that sum_m R_lm^2 = |k|^(2l).
+    Returns a list over l of arrays of shape (2l+1, *grid).
+    Uses the cartesian recursion so there is no singularity at k=0.
+    """
+    x, y, z = [k.astype(np.float64) for k in kvec]
+    shape = np.broadcast(x, y, z).shape
+    r2 = x**2 + y**2 + z**2
+    C = {(0, 0):np.ones(shape)}
+    S = {(0, 0):np.zeros(shape)}
+    harmonics = []
+    for l in range(lmax+1):
+        if l > 0:
+            C[l, l] = -(2*l-1)*(x*C[l-1, l-1] - y*S[l-1, l-1])
+            S[l, l] = -(2*l-1)*(y*C[l-1, l-1] + x*S[l-1, l-1])
+            for m in range(l):
+                cp, sp = C.get((l-2, m), 0), S.get((l-2, m), 0)
+                C[l, m] = ((2*l-1)*z*C[l-1, m] - (l-1+m)*r2*cp)/(l-m)
+                S[l, m] = ((2*l-1)*z*S[l-1, m] - (l-1+m)*r2*sp)/(l-m)
+            for m in range(l):
+                C.pop((l-2, m), None); S.pop((l-2, m), None)
+        rl = np.empty((2*l+1,) + shape, dtype=dtype)
+        for m in range(l+1):
+            norm = ((2 - (m == 0))*factorial(l-m)/factorial(l+m))**0.5
+            rl[l+m] = norm*C[l, m]
+            if m > 0: rl[l-m] = norm*S[l, m]
+        harmonics.append(rl)
+    return harmonics
+
+
+
+class CompactMoments:
+    def __init__(self, values, index):
+        """ Moments stored once per unique coefficient.
+        values : array (..., nunique)
+        index : int array (ncoef, npowers) pointing every coefficient of the full
+        layout to its column in values.
+        Indexing expands lazily, e.g. cm[:, :, 8] only builds the requested slice:
+        the leading axes of the key apply to values, the last two to index.
+        """
+        self.values = np.asarray(values)
+        self.index = np.asarray(index)
+        self.shape = self.values.shape[:-1] + self.index.shape
+
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple): key = (key,)
+        nlead = self.values.ndim - 1
+        lead, rest = key[:nlead], key[nlead:]
+        return self.values[lead + (Ellipsis,)][..., self.index[rest]]
+
+
+    def expand(self):
+        return self.values[..., self.index]
+
+
+    def save(self, fname):
+        np.savez(fname, values=self.values, index=self.index)
+
+
+    @classmethod
+    def load(cls, fname):
+        f = np.load(fname)
+        return cls(f['values'], f['index'])
+
+
+    @classmethod
+    def stack(cls, cms):
+        for cm in cms[1:]:
+            if not np.array_equal(cm.index, cms[0].index): raise Exception('Incompatible moment layouts')
+        return cls(np.stack([cm.values for cm in cms]), cms[0].index)
+
+
+
+def compact(w, rtol=1e-6, atol=0.):
+    """ Compact an existing moment array w (nsim, ncoef, npowers) by detecting
+    coefficients that are equal (within rtol) across all sims, e.g. integral powers
+    stored twice or L2 moments that do not depend on the harmonic order.
+    """
+    nsim, ncoef, npow = w.shape
+    cols = w.reshape(nsim, -1)
+    norms = np.linalg.norm(cols, axis=0)
+    order = np.argsort(norms, kind='stable')
+    index = np.empty(cols.shape[1], dtype=int)
+    reps = []
+    for i in order:
+        found = -1
+        for u in range(len(reps)-1, -1, -1):
+            r = reps[u]
+            if norms[i] - norms[r] > rtol*norms[i] + atol*nsim**0.5: break
+            if np.allclose(cols[:, i], cols[:, r], rtol=rtol, atol=atol):
+                found = u
+                break
+        if found < 0:
+            reps.append(i)
+            found = len(reps) - 1
+        index[i] = found
+    return CompactMoments(cols[:, reps], index.reshape(ncoef, npow))
+
+
+
+class HarmonicMoments:
+    def __init__(self, nc, J, L, powers, sigma=0.8, dtype=np.float32, batch=3, chunk=16):
+        """ Filter bank for solid harmonic wavelet moments on a nc^3 mesh.
+        J : list of scales, sigma_j = sigma * 2^j in units of cells
+        L : list of harmonic orders
+        powers : list of integral powers q
+        batch : number of harmonics m inverse transformed together
+        chunk : number of slabs over which all powers are accumulated at once
+
+        The filter bank is built once in Fourier space: one gaussian per scale and
+        one solid harmonic per (l, m), sigma_j^l R_lm(k) G_j(k) is formed on the fly.
+
+        Repeated powers are evaluated and stored once (self.index maps the full
+        layout to the unique ones). This is only deduplication: with sum_m R_lm^2 =
+        |k|^(2l) the q=2 moments change with l, so nothing is dropped across L. Use
+        compact() on a stack of moments to find coefficients that are equal in the data.
+        If powers is [2] alone, the moments follow from Parseval as
+          sum_x U_jl^2 = sum_k |field_k|^2 G_j(k)^2 sigma_j^(2l) |k|^(2l) / N
+        without inverse transforms; otherwise q=2 is the sum of the U_jl^2 already computed.
+        The harmonics with l > 0 are zeroed on the Nyquist planes, where they are not
+        hermitian and irfftn would drop part of them, so both paths give the same sums.
+        """
+        self.nc, self.J, self.L, self.powers = nc, list(J), list(L), list(powers)
+        self.sigma, self.dtype, self.batch, self.chunk = sigma, dtype, batch, chunk
+        self.cdtype = np.result_type(dtype, np.complex64)
+        self.upowers, pindex = np.unique(self.powers, return_inverse=True)
+        self.upowers = list(self.upowers)
+        self.parseval = self.upowers == [2]
+        nj, nu = len(self.J), len(self.upowers)
+        self.index = (np.arange(len(self.L)*nj)[:, None]*nu + pindex[None, :]).reshape(-1, len(self.powers))
+        kvec = tools.fftk([nc]*3, nc, dtype=np.float64)
+        kk = sum(k**2 for k in kvec)
+        self.gauss = [np.exp(-0.5*kk*(sigma*2**j)**2).astype(dtype) for j in self.J]
+        self.kk = kk.astype(dtype)
+        #weight of each rfft mode in the full sum over k
+        self.hermitian = np.full(nc//2+1, 2, dtype=dtype)
+        self.hermitian[0] = 1
+        if nc%2 == 0: self.hermitian[-1] = 1
+        harmonics = solidharmonics(kvec, max(self.L), dtype=dtype)
+        self.harmonics = {l:harmonics[l] for l in self.L}
+        if nc%2 == 0:
+            #kk**l for Parseval is zeroed with them, kk**0 stays 1
+            for x in [self.kk] + [self.harmonics[l] for l in self.L if l > 0]:
+                x[..., nc//2, :, :] = 0
+                x[..., nc//2, :] = 0
+                x[..., nc//2] = 0
+        del kk, harmonics
+
+
+    def modulus2(self, fieldc, j, l):
+        """ U_jl^2 = sum_m |field * psi_jlm|^2 from the rfft of the field """
+        shape = (self.nc,)*3
+        ij = self.J.index(j)
+        scale = (-1j)**l * (self.sigma*2**j)**l
+        fg = fieldc*self.gauss[ij]
+        fg *= scale
+        u2 = np.zeros(shape, dtype=self.dtype)
+        harm = self.harmonics[l]
+        for m0 in range(0, 2*l+1, self.batch):
+            filtered = fftbackend.irfftn(fg[None]*harm[m0:m0+self.batch], s=shape, axes=(-3, -2, -1))
+            u2 += (filtered**2).sum(axis=0)
+            del filtered
+        return u2
+
+
+    def integrals(self, u2, powers):
+        """ sum_x U^q for all powers in a single pass over U^2, slab chunk by slab chunk """
+        out = np.zeros(len(powers))
+        for i0 in range(0, u2.shape[0], self.chunk):
+            u = u2[i0:i0+self.chunk].astype(np.float64)
+            for iq, q in enumerate(powers):
+                if q == 2: out[iq] += u.sum()
+                else: out[iq] += (u**(0.5*q)).sum()
+        return out
+
+
+    def l2moments(self, fieldc):
+        """ q=2 moments of all (l, j) from the Fourier modes, no inverse transforms """
+        pk = (fieldc.real**2 + fieldc.imag**2)*self.hermitian
+        out = np.zeros((len(self.L), len(self.J)))
+        for ij, j in enumerate(self.J):
+            pg = pk*self.gauss[ij]**2
+            for il, l in enumerate(self.L):
+                out[il, ij] = (pg*self.kk**l).sum(dtype=np.float64) * (self.sigma*2**j)**(2*l)
+        return out/self.nc**3
+
+
+    def __call__(self, field, demean=True, compact=False):
+        """ Moments of a real field, shape (len(L)*len(J), len(powers)).
+        If compact, return a CompactMoments holding each unique coefficient once.
+        """
+        field = np.asarray(field, dtype=self.dtype)
+        if demean: field = field/field.mean() - 1
+        fieldc = fftbackend.rfftn(field).astype(self.cdtype)
+        return self.fromfourier(fieldc, compact=compact)
+
+
+    def fromfourier(self, fieldc, demean=False, compact=False):
+        """ Moments from the unnormalized rfft of a field, as __call__ """
+        if demean:
+            fieldc = fieldc*(self.nc**3/fieldc[0, 0, 0].real)
+            fieldc[0, 0, 0] = 0
+        fieldc = np.asarray(fieldc, dtype=self.cdtype)
+        out = np.zeros((len(self.L), len(self.J), len(self.upowers)))
+        if self.parseval: out[..., 0] = self.l2moments(fieldc)
+        else:
+            for il, l in enumerate(self.L):
+                for ij, j in enumerate(self.J):
+                    out[il, ij] = self.integrals(self.modulus2(fieldc, j, l), self.upowers)
+        cm = CompactMoments(out.reshape(-1), self.index)
+        if compact: return cm
+        return cm.expand()
+
+
+
+def moments_from_files(fnames, engine, demean=True, compact=False):
+    """ Stack the moments of a list of saved fields """
+    moments = []
+    for fname in fnames:
+        if fieldio.modes_exist(fname):
+            #cached modes are normalized by 1/N
+            fieldc = np.array(fieldio.load_modes(fname))
+            if not demean: fieldc *= engine.nc**3
+            moments.append(engine.fromfourier(fieldc, demean=demean, compact=compact))
+        else: moments.append(engine(fieldio.load_field(fname), demean=demean, compact=compact))
+    if compact: return CompactMoments.stack(moments)
+    return np.stack(moments)
+
+
+def benchmark(ncs, J, L, powers, nfields=2, seed=0):
+    """ Print fields per second for random fields at each mesh size """
+    for nc in ncs:
+        t0 = time.time()
+        engine = HarmonicMoments(nc, J, L, powers)
+        tbank = time.time() - t0
+        np.random.seed(seed)
+        fields = [1 + 0.1*np.random.normal(size=(nc, nc, nc)).astype(np.float32) for i in range(nfields)]
+        t0 = time.time()
+        for field in fields: engine(field)
+        tt = time.time() - t0
+        print("nc=%d : filter bank %0.2f s, %0.3f fields/s"%(nc, tbank, nfields/tt))
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Solid harmonic wavelet moments of painted fields.')
+    parser.add_argument('--folder', type=str, default=None, help='folder with one subfolder %%04d/ per sim, benchmark if not given')
+    parser.add_argument('--id0', type=int, default=0, help='sim number to start from')
+    parser.add_argument('--id1', type=int, default=2000, help='sim number to go upto')
+    parser.add_argument('--nc', type=int, nargs='+', default=[128, 256], help='mesh sizes to benchmark')
+    parser.add_argument('--J', type=int, nargs='+', default=[0, 1, 2, 3, 4], help='scales')
+    parser.add_argument('--L', type=int, nargs='+', default=[0, 1, 2, 3, 4], help='harmonic orders')
+    parser.add_argument('--powers', type=float, nargs='+', default=[0.5, 1., 2.], help='integral powers')
+    parser.add_argument('--nfields', type=int, default=2, help='number of fields for the benchmark')
+    args = parser.parse_args()
+
+    if args.folder is None:
+        benchmark(args.nc, args.J, args.L, args.powers, nfields=args.nfields)
+    else:
+        engine = None
+        for idd in range(args.id0, args.id1):
+            savepath = args.folder + '%04d/'%idd
+            if not fieldio.field_exists(savepath + 'field'): continue
+            print(idd)
+            field = fieldio.load_field(savepath + 'field')
+            if engine is None: engine = HarmonicMoments(field.shape[0], args.J, args.L, args.powers)
+            cm = engine(field, compact=True)
+            np.savez(savepath + 'wavelets', values=cm.values, index=cm.index, J=args.J, Ls=args.L, integral_powers=args.powers)